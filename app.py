@@ -1,41 +1,113 @@
 import os
-import uuid
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
 from flask import Flask, render_template, redirect, url_for, flash, request, abort, jsonify, send_file
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 import json
 
 from config import Config
 from models import db, User, Course, Module, Content, Quiz, Question, Assignment
-from models import Enrollment, Progress, QuizAttempt, Submission, ForumThread, ForumPost
-from models import ContentCompletion
+from models import Enrollment, QuizAttempt, Submission, ForumThread, ForumPost
+from models import ContentCompletion, QuizCompletion, AssignmentCompletion, Upload, insert_or_ignore
 from forms import RegistrationForm, LoginForm, CourseForm, ModuleForm, ContentForm
-from forms import QuizForm, QuestionForm, AssignmentForm
+from forms import QuizForm, QuestionForm, AssignmentForm, THUMBNAIL_EXTENSIONS, SUBMISSION_EXTENSIONS
+from quiz_engine import AnswerKeyCache, grade_submission as grade_quiz
+from completion import DEFAULT_PASSING_SCORE, record_item_completed
+from completion import refresh_content_rows, refresh_quiz_rows, insert_completion
+from completion import insert_completions
+from write_behind import WriteBehindQueue
+from search import index_course, search_courses, CategoryCache
+from pagination import keyset_paginate
+from media import send_upload
+from uploads import UploadError, create_upload, write_chunk, claim_upload, check_extension, check_image
+from blobstore import store_upload
+from certificates import issue_certificate
+from engine_profiles import init_engine_profile
+from instrumentation import init_instrumentation
+from metrics import init_metrics, track_cache
+from fragments import create_fragment_cache
+from identity import IdentityCache, AccessCache
+from hierarchy import CourseHierarchy
+from thumbnails import schedule_derivatives, derivative_for, thumbnail_srcset, FORMATS as THUMBNAIL_FORMATS
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+init_engine_profile(app)
 db.init_app(app)
+init_instrumentation(app)
+init_metrics(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+answer_keys = AnswerKeyCache(ttl=app.config['QUIZ_KEY_CACHE_TTL'])
+hierarchy = CourseHierarchy()
+hierarchy.track()
+fragments = create_fragment_cache(app)
+identities = IdentityCache(ttl=app.config['IDENTITY_CACHE_TTL'], max_entries=app.config['IDENTITY_CACHE_SIZE'])
+access = AccessCache(ttl=app.config['ACCESS_CACHE_TTL'], max_entries=app.config['ACCESS_CACHE_SIZE'])
+search_categories = CategoryCache()
+track_cache('answer_keys', answer_keys)
+track_cache('hierarchy', hierarchy)
+track_cache('fragments', fragments)
+track_cache('identities', identities)
+track_cache('access', access)
+track_cache('search_categories', search_categories)
+
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identities.get(int(user_id))
+
+
+# ==================== WRITE-BEHIND ====================
+def bump_post_counts(rows):
+    for thread_id, count in Counter(row['thread_id'] for row in rows).items():
+        db.session.execute(db.update(ForumThread).where(ForumThread.id == thread_id).values(
+            post_count=ForumThread.post_count + count
+        ))
+
+
+write_behind = WriteBehindQueue(
+    app,
+    journal_path=app.config['WRITE_BEHIND_JOURNAL'],
+    batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+    max_latency=app.config['WRITE_BEHIND_MAX_LATENCY'],
+    fsync=app.config['WRITE_BEHIND_FSYNC'],
+    compact_bytes=app.config['WRITE_BEHIND_COMPACT_BYTES']
+)
+write_behind.register(QuizAttempt, on_flush=refresh_quiz_rows)
+write_behind.register(ContentCompletion, ignore_conflicts=True, on_flush=refresh_content_rows)
+write_behind.register(ForumPost, on_flush=bump_post_counts)
+
+
+@app.before_request
+def start_write_behind():
+    # Started by each worker on its first request rather than at import, so a
+    # preloading master or a script that imports app never takes a journal or
+    # replays the ones running workers own
+    if app.config['WRITE_BEHIND_ENABLED']:
+        write_behind.start()
+
+
+@app.before_request
+def sync_pending_writes():
+    # Read-your-writes: commit a user's queued rows before serving them a page
+    if write_behind.enabled and request.method == 'GET' and current_user.is_authenticated:
+        if write_behind.has_pending(current_user.id):
+            write_behind.flush()
 
 
 # ==================== AUTHENTICATION ROUTES ====================
 @app.route('/')
 def index():
     courses = Course.query.order_by(Course.created_at.desc()).limit(6).all()
-    return render_template('index.html', courses=courses)
+    return render_template('index.html', cards=[course_card(course) for course in courses])
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -95,10 +167,36 @@ def dashboard():
         return render_template('dashboard.html', teaching_courses=teaching_courses)
     else:
         enrollments = Enrollment.query.filter_by(student_id=current_user.id).all()
-        return render_template('dashboard.html', enrollments=enrollments)
+        progress = get_progress_for_courses(current_user.id, [e.course_id for e in enrollments])
+        return render_template('dashboard.html', enrollments=enrollments, progress=progress)
 
 
 # ==================== COURSE MANAGEMENT ====================
+def course_card(course):
+    return fragments.render(f'course-card:{course.id}', course.cache_version, 'fragments/course_card.html',
+                            lambda: {'course': course})
+
+
+def add_required_item(course_id):
+    # One more item to complete, and a changed outline for the fragment cache
+    db.session.execute(db.update(Course).where(Course.id == course_id).values(
+        required_item_count=Course.required_item_count + 1,
+        cache_version=Course.cache_version + 1
+    ))
+
+
+def load_course_tree(course_id):
+    # Fetch the whole outline (modules with their contents, quizzes and assignments)
+    # in a fixed number of queries regardless of how many modules the course has.
+    modules = db.selectinload(Course.modules)
+    return Course.query.options(
+        db.joinedload(Course.instructor),
+        modules.selectinload(Module.contents),
+        modules.selectinload(Module.quizzes),
+        modules.selectinload(Module.assignments)
+    ).filter_by(id=course_id).first_or_404()
+
+
 @app.route('/course/create', methods=['GET', 'POST'])
 @login_required
 def create_course():
@@ -108,10 +206,16 @@ def create_course():
     form = CourseForm()
     if form.validate_on_submit():
         thumbnail_filename = None
-        if form.thumbnail.data:
-            file = form.thumbnail.data
-            thumbnail_filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], thumbnail_filename))
+        try:
+            if form.thumbnail.data:
+                check_image(form.thumbnail.data.stream)
+                thumbnail_filename = store_upload(form.thumbnail.data)
+            elif request.form.get('upload_id'):
+                thumbnail_filename = claim_upload(request.form['upload_id'], current_user.id,
+                                                  THUMBNAIL_EXTENSIONS, image=True)
+        except UploadError as e:
+            flash(e.message, 'danger')
+            return render_template('create_course.html', form=form)
 
         course = Course(
             title=form.title.data,
@@ -121,7 +225,11 @@ def create_course():
             instructor_id=current_user.id
         )
         db.session.add(course)
+        db.session.flush()
+        index_course(course.id)
         db.session.commit()
+        access.invalidate(current_user.id)
+        schedule_derivatives(course.thumbnail)
         flash('Course created successfully!', 'success')
         return redirect(url_for('manage_course', course_id=course.id))
 
@@ -130,22 +238,29 @@ def create_course():
 
 @app.route('/course/<int:course_id>')
 def view_course(course_id):
-    course = Course.query.get_or_404(course_id)
-    is_enrolled = False
-    if current_user.is_authenticated:
-        enrollment = Enrollment.query.filter_by(
+    course = Course.query.options(db.joinedload(Course.instructor)).filter_by(id=course_id).first_or_404()
+    is_enrolled = is_completed = False
+    if current_user.is_authenticated and access.is_enrolled(current_user.id, course_id):
+        is_enrolled = True
+        is_completed = bool(db.session.query(Enrollment.completed).filter_by(
             student_id=current_user.id,
             course_id=course_id
-        ).first()
-        is_enrolled = enrollment is not None
+        ).scalar())
+
+    # The outline is the same for every enrolled student; only load the tree to render it
+    outline = None
+    if is_enrolled:
+        outline = fragments.render(f'course-outline:{course_id}', course.cache_version,
+                                   'fragments/course_outline.html', lambda: {'course': load_course_tree(course_id)})
 
-    return render_template('course.html', course=course, is_enrolled=is_enrolled)
+    return render_template('course.html', course=course, is_enrolled=is_enrolled, is_completed=is_completed,
+                           outline=outline)
 
 
 @app.route('/course/<int:course_id>/manage')
 @login_required
 def manage_course(course_id):
-    course = Course.query.get_or_404(course_id)
+    course = load_course_tree(course_id)
     if course.instructor_id != current_user.id:
         abort(403)
 
@@ -157,23 +272,47 @@ def manage_course(course_id):
 def enroll_course(course_id):
     course = Course.query.get_or_404(course_id)
 
-    existing = Enrollment.query.filter_by(
-        student_id=current_user.id,
-        course_id=course_id
-    ).first()
-
-    if not existing:
-        enrollment = Enrollment(
-            student_id=current_user.id,
-            course_id=course_id
-        )
-        db.session.add(enrollment)
+    if insert_or_ignore(Enrollment, student_id=current_user.id, course_id=course_id):
+        course.enrollment_count = Course.enrollment_count + 1
         db.session.commit()
+        access.invalidate(current_user.id)
         flash(f'You have successfully enrolled in {course.title}!', 'success')
 
     return redirect(url_for('view_course', course_id=course_id))
 
 
+def course_page(cursor):
+    query = Course.query.options(db.joinedload(Course.instructor))
+    return keyset_paginate(query, Course, cursor=cursor, per_page=app.config['COURSES_PER_PAGE'])
+
+
+@app.route('/admin/courses')
+@login_required
+def admin_courses():
+    if not current_user.is_instructor:
+        abort(403)
+
+    page = course_page(request.args.get('cursor'))
+    return render_template('admin_courses.html', courses=page.items, next_cursor=page.next_cursor)
+
+
+@app.route('/api/courses')
+def courses_json():
+    page = course_page(request.args.get('cursor'))
+    return jsonify({
+        'courses': [{
+            'id': course.id,
+            'title': course.title,
+            'category': course.category,
+            'instructor': course.instructor.username,
+            'modules': course.module_count,
+            'students': course.enrollment_count,
+            'created_at': course.created_at.isoformat()
+        } for course in page.items],
+        'next_cursor': page.next_cursor
+    })
+
+
 # ==================== MODULE MANAGEMENT ====================
 @app.route('/course/<int:course_id>/module/add', methods=['GET', 'POST'])
 @login_required
@@ -191,6 +330,10 @@ def add_module(course_id):
             course_id=course_id
         )
         db.session.add(module)
+        course.module_count = Course.module_count + 1
+        course.cache_version = Course.cache_version + 1
+        db.session.flush()
+        index_course(course_id)
         db.session.commit()
         flash('Module added successfully!', 'success')
         return redirect(url_for('manage_course', course_id=course_id))
@@ -203,7 +346,7 @@ def add_module(course_id):
 @login_required
 def add_content(module_id):
     module = Module.query.get_or_404(module_id)
-    if module.course.instructor_id != current_user.id:
+    if not access.is_instructor_of(current_user.id, module.course_id):
         abort(403)
 
     form = ContentForm()
@@ -217,9 +360,12 @@ def add_content(module_id):
             module_id=module_id
         )
         db.session.add(content)
+        add_required_item(module.course_id)
+        db.session.flush()
+        index_course(module.course_id)
         db.session.commit()
         flash('Content added successfully!', 'success')
-        return redirect(url_for('manage_course', course_id=module.course.id))
+        return redirect(url_for('manage_course', course_id=module.course_id))
 
     return render_template('add_content.html', form=form, module=module)
 
@@ -227,15 +373,12 @@ def add_content(module_id):
 @app.route('/learn/<int:course_id>/module/<int:module_id>/content/<int:content_id>')
 @login_required
 def view_content(course_id, module_id, content_id):
+    if not access.is_enrolled(current_user.id, course_id):
+        abort(404)
     course = Course.query.get_or_404(course_id)
     module = Module.query.get_or_404(module_id)
     content = Content.query.get_or_404(content_id)
 
-    enrollment = Enrollment.query.filter_by(
-        student_id=current_user.id,
-        course_id=course_id
-    ).first_or_404()
-
     return render_template('view_content.html', course=course, module=module, content=content)
 
 
@@ -244,7 +387,7 @@ def view_content(course_id, module_id, content_id):
 @login_required
 def add_quiz(module_id):
     module = Module.query.get_or_404(module_id)
-    if module.course.instructor_id != current_user.id:
+    if not access.is_instructor_of(current_user.id, module.course_id):
         abort(403)
 
     form = QuizForm()
@@ -257,6 +400,7 @@ def add_quiz(module_id):
             module_id=module_id
         )
         db.session.add(quiz)
+        add_required_item(module.course_id)
         db.session.commit()
         flash('Quiz added successfully!', 'success')
         return redirect(url_for('manage_quiz', quiz_id=quiz.id))
@@ -268,17 +412,19 @@ def add_quiz(module_id):
 @login_required
 def manage_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
-    if quiz.module.course.instructor_id != current_user.id:
+    course_id = hierarchy.course_of('quiz', quiz_id)
+    if not access.is_instructor_of(current_user.id, course_id):
         abort(403)
 
-    return render_template('manage_quiz.html', quiz=quiz)
+    return render_template('manage_quiz.html', quiz=quiz, course_id=course_id)
 
 
 @app.route('/quiz/<int:quiz_id>/question/add', methods=['GET', 'POST'])
 @login_required
 def add_question(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
-    if quiz.module.course.instructor_id != current_user.id:
+    course_id = hierarchy.course_of('quiz', quiz_id)
+    if not access.is_instructor_of(current_user.id, course_id):
         abort(403)
 
     form = QuestionForm()
@@ -297,6 +443,7 @@ def add_question(quiz_id):
         )
         db.session.add(question)
         db.session.commit()
+        answer_keys.invalidate(quiz_id)
         flash('Question added successfully!', 'success')
         return redirect(url_for('manage_quiz', quiz_id=quiz_id))
 
@@ -306,37 +453,37 @@ def add_question(quiz_id):
 @app.route('/quiz/<int:quiz_id>/take', methods=['GET', 'POST'])
 @login_required
 def take_quiz(quiz_id):
-    quiz = Quiz.query.get_or_404(quiz_id)
+    answer_key = answer_keys.get(quiz_id)
+    if answer_key is None:
+        abort(404)
+    if not access.can_view(current_user.id, answer_key.course_id):
+        abort(403)
 
     if request.method == 'POST':
-        score = 0
-        total_points = 0
-        answers = {}
-
-        for question in quiz.questions:
-            answer = request.form.get(f'question_{question.id}')
-            answers[str(question.id)] = answer
+        final_score, answers = grade_quiz(answer_key, request.form)
 
-            if answer == question.correct_answer:
-                score += question.points
-            total_points += question.points
-
-        final_score = (score / total_points * 100) if total_points > 0 else 0
-
-        attempt = QuizAttempt(
+        attempt = dict(
             user_id=current_user.id,
             quiz_id=quiz_id,
             score=final_score,
             answers=json.dumps(answers),
             completed_at=datetime.utcnow()
         )
-        db.session.add(attempt)
-        db.session.commit()
+        if write_behind.enabled:
+            write_behind.enqueue(QuizAttempt, owner_id=current_user.id, **attempt)
+        else:
+            passing_score = DEFAULT_PASSING_SCORE if answer_key.passing_score is None else answer_key.passing_score
+            # Only the attempt that records the quiz's completion row counts towards the course
+            if final_score >= passing_score and insert_or_ignore(
+                    QuizCompletion, user_id=current_user.id, quiz_id=quiz_id, completed_at=attempt['completed_at']):
+                record_item_completed(current_user.id, answer_key.course_id)
+            db.session.add(QuizAttempt(**attempt))
+            db.session.commit()
 
         flash(f'Quiz completed! Your score: {final_score:.1f}%', 'success')
-        return redirect(url_for('view_course', course_id=quiz.module.course.id))
+        return redirect(url_for('view_course', course_id=answer_key.course_id))
 
-    return render_template('take_quiz.html', quiz=quiz)
+    return render_template('take_quiz.html', quiz=answer_key)
 
 
 # ==================== ASSIGNMENT MANAGEMENT ====================
@@ -344,7 +491,7 @@ def take_quiz(quiz_id):
 @login_required
 def add_assignment(module_id):
     module = Module.query.get_or_404(module_id)
-    if module.course.instructor_id != current_user.id:
+    if not access.is_instructor_of(current_user.id, module.course_id):
         abort(403)
 
     form = AssignmentForm()
@@ -361,9 +508,10 @@ def add_assignment(module_id):
             module_id=module_id
         )
         db.session.add(assignment)
+        add_required_item(module.course_id)
         db.session.commit()
         flash('Assignment added successfully!', 'success')
-        return redirect(url_for('manage_course', course_id=module.course.id))
+        return redirect(url_for('manage_course', course_id=module.course_id))
 
     return render_template('add_assignment.html', form=form, module=module)
 
@@ -372,16 +520,24 @@ def add_assignment(module_id):
 @login_required
 def submit_assignment(assignment_id):
     assignment = Assignment.query.get_or_404(assignment_id)
+    course_id = hierarchy.course_of('assignment', assignment_id)
+    if not access.can_view(current_user.id, course_id):
+        abort(403)
 
     if request.method == 'POST':
         submission_text = request.form.get('submission_text')
         file = request.files.get('file')
 
         file_url = None
-        if file and file.filename:
-            filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            file_url = filename
+        try:
+            if file and file.filename:
+                check_extension(file.filename, SUBMISSION_EXTENSIONS)
+                file_url = store_upload(file)
+            elif request.form.get('upload_id'):
+                file_url = claim_upload(request.form['upload_id'], current_user.id, SUBMISSION_EXTENSIONS)
+        except UploadError as e:
+            flash(e.message, 'danger')
+            return redirect(url_for('submit_assignment', assignment_id=assignment_id))
 
         submission = Submission(
             user_id=current_user.id,
@@ -394,87 +550,366 @@ def submit_assignment(assignment_id):
         db.session.commit()
 
         flash('Assignment submitted successfully!', 'success')
-        return redirect(url_for('view_course', course_id=assignment.module.course.id))
+        return redirect(url_for('view_course', course_id=course_id))
+
+    return render_template('submit_assignment.html', assignment=assignment, course_id=course_id)
+
+
+@app.route('/submission/<int:submission_id>/grade', methods=['GET', 'POST'])
+@login_required
+def grade_submission(submission_id):
+    submission = Submission.query.get_or_404(submission_id)
+    assignment = submission.assignment
+    course_id = hierarchy.course_of('assignment', assignment.id)
+    if not access.is_instructor_of(current_user.id, course_id):
+        abort(403)
+
+    if request.method == 'POST':
+        try:
+            score = float(request.form.get('score', ''))
+        except ValueError:
+            flash('Enter a numeric score.', 'danger')
+            return redirect(url_for('grade_submission', submission_id=submission_id))
+        if not 0 <= score <= (assignment.max_score or 0):
+            flash(f'Score must be between 0 and {assignment.max_score}.', 'danger')
+            return redirect(url_for('grade_submission', submission_id=submission_id))
+
+        # The first graded submission for an assignment completes that item
+        submission.graded_at = datetime.utcnow()
+        if insert_or_ignore(AssignmentCompletion, user_id=submission.user_id, assignment_id=assignment.id,
+                            completed_at=submission.graded_at):
+            record_item_completed(submission.user_id, course_id)
+        submission.score = score
+        submission.feedback = request.form.get('feedback')
+        db.session.commit()
+
+        flash('Submission graded successfully!', 'success')
+        return redirect(url_for('submit_assignment', assignment_id=assignment.id))
+
+    return render_template('grade_submission.html', submission=submission, course_id=course_id)
+
+
+# ==================== CHUNKED UPLOADS ====================
+def upload_status(upload):
+    return {
+        'upload_id': upload.id,
+        'offset': upload.received,
+        'size': upload.size,
+        'complete': upload.completed_at is not None,
+        'sha256': upload.sha256
+    }
+
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def start_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = create_upload(current_user.id, data.get('filename'), data.get('size'))
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status
+    return jsonify(upload_status(upload)), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    upload = Upload.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+
+    if request.method == 'PATCH':
+        try:
+            write_chunk(
+                upload,
+                request.headers.get('Upload-Offset', type=int),
+                request.stream,
+                request.content_length,
+                expected_sha256=request.headers.get('Upload-Checksum')
+            )
+        except UploadError as e:
+            return jsonify(dict(upload_status(upload), status='error', message=e.message)), e.status
+
+    return jsonify(upload_status(upload))
+
+
+# ==================== MEDIA ====================
+@app.route('/course/<int:course_id>/thumbnail')
+def course_thumbnail(course_id):
+    thumbnail = db.session.query(Course.thumbnail).filter_by(id=course_id).scalar()
+    return send_upload(thumbnail)
+
+
+@app.route('/course/<int:course_id>/thumbnail/<int:width>.<image_format>')
+def course_thumbnail_variant(course_id, width, image_format):
+    if width not in app.config['THUMBNAIL_WIDTHS'] or image_format not in THUMBNAIL_FORMATS:
+        abort(404)
+
+    thumbnail = db.session.query(Course.thumbnail).filter_by(id=course_id).scalar()
+    if not thumbnail:
+        abort(404)
+
+    name = derivative_for(thumbnail, width, image_format)
+    if name is None:
+        # Still rendering: hand out the original without letting it be cached
+        return send_upload(thumbnail, max_age=0)
+    return send_upload(name)
+
+
+@app.route('/content/<int:content_id>/media')
+@login_required
+def content_media(content_id):
+    row = db.session.query(Content.content_url, Module.course_id).join(
+        Module, Content.module_id == Module.id
+    ).filter(Content.id == content_id).first_or_404()
 
-    return render_template('submit_assignment.html', assignment=assignment)
+    if not access.can_view(current_user.id, row.course_id):
+        abort(404)
+
+    return send_upload(row.content_url, private=True)
+
+
+@app.route('/submission/<int:submission_id>/file')
+@login_required
+def submission_file(submission_id):
+    row = db.session.query(Submission.file_url, Submission.user_id, Course.instructor_id).join(
+        Assignment, Submission.assignment_id == Assignment.id
+    ).join(
+        Module, Assignment.module_id == Module.id
+    ).join(
+        Course, Module.course_id == Course.id
+    ).filter(Submission.id == submission_id).first_or_404()
+
+    if current_user.id not in (row.user_id, row.instructor_id):
+        abort(403)
+
+    return send_upload(row.file_url, max_age=0, private=True)
+
+
+# ==================== CERTIFICATES ====================
+@app.route('/course/<int:course_id>/certificate')
+@login_required
+def generate_certificate(course_id):
+    enrollment = Enrollment.query.filter_by(
+        student_id=current_user.id,
+        course_id=course_id
+    ).first_or_404()
+
+    if not enrollment.completed:
+        flash('Complete the course to earn a certificate.', 'warning')
+        return redirect(url_for('view_course', course_id=course_id))
+
+    # Issued once; later requests reuse the stored PDF
+    certificate = issue_certificate(enrollment)
+    return send_upload(certificate.certificate_url,
+                       download_name=f'certificate-{certificate.certificate_number}.pdf',
+                       max_age=0, private=True)
 
 
 # ==================== PROGRESS TRACKING ====================
 @app.route('/api/progress/<int:content_id>', methods=['POST'])
 @login_required
 def mark_content_complete(content_id):
-    content = Content.query.get_or_404(content_id)
+    course_id = hierarchy.course_of('content', content_id)
+    if course_id is None:
+        abort(404)
+
+    if write_behind.enabled:
+        if not access.is_enrolled(current_user.id, course_id):
+            return jsonify({'status': 'error', 'message': 'Not enrolled in this course'}), 403
+        if write_behind.is_pending(ContentCompletion, user_id=current_user.id, content_id=content_id) or \
+                ContentCompletion.query.filter_by(user_id=current_user.id, content_id=content_id).first():
+            return jsonify({'status': 'info', 'message': 'Already completed'})
+
+        write_behind.enqueue(ContentCompletion, owner_id=current_user.id,
+                             user_id=current_user.id, content_id=content_id, completed_at=datetime.utcnow())
+        return jsonify({'status': 'success', 'message': 'Content marked as complete'})
 
-    enrollment = Enrollment.query.filter_by(
-        student_id=current_user.id,
-        course_id=content.module.course.id
-    ).first()
+    if insert_completion(current_user.id, content_id, course_id):
+        record_item_completed(current_user.id, course_id)
+        db.session.commit()
+        return jsonify({'status': 'success', 'message': 'Content marked as complete'})
 
-    if not enrollment:
+    # Nothing was inserted: already complete, or not enrolled
+    if not access.is_enrolled(current_user.id, course_id):
         return jsonify({'status': 'error', 'message': 'Not enrolled in this course'}), 403
+    return jsonify({'status': 'info', 'message': 'Already completed'})
 
-    completion = ContentCompletion.query.filter_by(
-        user_id=current_user.id,
-        content_id=content_id
-    ).first()
 
-    if not completion:
-        completion = ContentCompletion(
-            user_id=current_user.id,
-            content_id=content_id
-        )
-        db.session.add(completion)
+def parse_client_time(value, now):
+    # Client clocks drift and offline events arrive late: accept ISO 8601 times,
+    # never later than now
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return now
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(parsed, now)
 
-        progress = Progress(
-            enrollment_id=enrollment.id,
-            content_id=content_id,
-            completed=True,
-            completed_at=datetime.utcnow()
-        )
-        db.session.add(progress)
+
+@app.route('/api/progress/batch', methods=['POST'])
+@login_required
+def mark_content_complete_batch():
+    events = (request.get_json(silent=True) or {}).get('events')
+    if not isinstance(events, list) or not events:
+        return jsonify({'status': 'error', 'message': 'A list of events is required'}), 400
+    if len(events) > app.config['PROGRESS_BATCH_MAX_EVENTS']:
+        return jsonify({'status': 'error', 'message': 'Too many events in one batch'}), 413
+
+    now = datetime.utcnow()
+    completed_at = {}
+    for event in events:
+        content_id = event.get('content_id') if isinstance(event, dict) else None
+        if not isinstance(content_id, int) or isinstance(content_id, bool):
+            return jsonify({'status': 'error', 'message': 'Every event needs an integer content_id'}), 400
+        timestamp = parse_client_time(event.get('completed_at'), now)
+        # The earliest report of an item wins
+        completed_at[content_id] = min(timestamp, completed_at.get(content_id, timestamp))
+
+    # One query per step however long the batch is: map to courses, check the
+    # enrollments, find what is already complete, insert the rest
+    courses = hierarchy.courses_of('content', completed_at)
+    enrolled = access.enrolled_in(current_user.id, courses.values())
+    accepted = [content_id for content_id in completed_at if courses.get(content_id) in enrolled]
+    existing = {content_id for content_id, in db.session.query(ContentCompletion.content_id).filter(
+        ContentCompletion.user_id == current_user.id,
+        ContentCompletion.content_id.in_(accepted)
+    )}
+    new = [content_id for content_id in accepted if content_id not in existing]
+
+    if write_behind.enabled:
+        new = [
+            content_id for content_id in new
+            if not write_behind.is_pending(ContentCompletion, user_id=current_user.id, content_id=content_id)
+        ]
+        for content_id in new:
+            write_behind.enqueue(ContentCompletion, owner_id=current_user.id,
+                                 user_id=current_user.id, content_id=content_id, completed_at=completed_at[content_id])
+        inserted = set(new)
+    else:
+        inserted = insert_completions([
+            {'user_id': current_user.id, 'content_id': content_id, 'completed_at': completed_at[content_id]}
+            for content_id in new
+        ])
+        for course_id, count in Counter(courses[content_id] for content_id in inserted).items():
+            record_item_completed(current_user.id, course_id, count)
         db.session.commit()
 
-        return jsonify({'status': 'success', 'message': 'Content marked as complete'})
+    return jsonify({
+        'status': 'success',
+        'completed': sorted(inserted),
+        'already_completed': sorted(set(accepted) - inserted),
+        'rejected': sorted(set(completed_at) - set(accepted))
+    })
 
-    return jsonify({'status': 'info', 'message': 'Already completed'})
+
+def get_progress_for_courses(user_id, course_ids):
+    course_ids = list(course_ids)
+    if not course_ids:
+        return {}
+
+    totals = dict(db.session.query(
+        Module.course_id, db.func.count(Content.id)
+    ).join(
+        Content, Content.module_id == Module.id
+    ).filter(
+        Module.course_id.in_(course_ids)
+    ).group_by(Module.course_id).all())
+
+    completed = dict(db.session.query(
+        Module.course_id, db.func.count(ContentCompletion.id)
+    ).join(
+        Content, ContentCompletion.content_id == Content.id
+    ).join(
+        Module, Content.module_id == Module.id
+    ).filter(
+        ContentCompletion.user_id == user_id,
+        Module.course_id.in_(course_ids)
+    ).group_by(Module.course_id).all())
+
+    progress = {}
+    for course_id in course_ids:
+        total_contents = totals.get(course_id, 0)
+        completed_contents = completed.get(course_id, 0)
+        progress[course_id] = {
+            'total': total_contents,
+            'completed': completed_contents,
+            'percentage': (completed_contents / total_contents * 100) if total_contents > 0 else 0
+        }
+    return progress
 
 
 @app.route('/api/course/<int:course_id>/progress')
 @login_required
 def get_course_progress(course_id):
-    total_contents = db.session.query(Content).join(Module).filter(Module.course_id == course_id).count()
+    if not access.is_enrolled(current_user.id, course_id):
+        return jsonify({'status': 'error', 'message': 'Not enrolled in this course'}), 403
+    return jsonify(get_progress_for_courses(current_user.id, [course_id])[course_id])
 
-    completed_contents = db.session.query(ContentCompletion).join(
-        Content
-    ).join(
-        Module
-    ).filter(
-        ContentCompletion.user_id == current_user.id,
-        Module.course_id == course_id
-    ).count()
 
-    progress_percentage = (completed_contents / total_contents * 100) if total_contents > 0 else 0
+@app.route('/api/progress')
+@login_required
+def get_bulk_progress():
+    course_ids = set()
+    for value in request.args.get('course_ids', '').split(','):
+        if value.strip().isdigit():
+            course_ids.add(int(value))
+    # At most one catalog page of courses per call, and only the caller's own
+    limit = app.config['COURSES_PER_PAGE']
+    if len(course_ids) > limit:
+        return jsonify({'status': 'error', 'message': f'At most {limit} course ids per request'}), 400
 
-    return jsonify({
-        'total': total_contents,
-        'completed': completed_contents,
-        'percentage': progress_percentage
-    })
+    progress = get_progress_for_courses(current_user.id, access.enrolled_in(current_user.id, course_ids))
+    return jsonify({str(course_id): data for course_id, data in progress.items()})
 
 
 # ==================== FORUM ROUTES ====================
+def thread_page(course_id, cursor):
+    query = ForumThread.query.options(db.joinedload(ForumThread.user)).filter_by(course_id=course_id)
+    return keyset_paginate(query, ForumThread, cursor=cursor,
+                           per_page=app.config['FORUM_THREADS_PER_PAGE'])
+
+
+def post_page(thread_id, cursor):
+    query = ForumPost.query.options(db.joinedload(ForumPost.user)).filter_by(thread_id=thread_id)
+    return keyset_paginate(query, ForumPost, cursor=cursor, descending=False,
+                           per_page=app.config['FORUM_POSTS_PER_PAGE'])
+
+
 @app.route('/course/<int:course_id>/forum')
 @login_required
 def forum(course_id):
     course = Course.query.get_or_404(course_id)
-    threads = ForumThread.query.filter_by(course_id=course_id).order_by(ForumThread.created_at.desc()).all()
-    return render_template('forum.html', course=course, threads=threads)
+    if not access.can_view(current_user.id, course_id):
+        abort(403)
+    page = thread_page(course_id, request.args.get('cursor'))
+    return render_template('forum.html', course=course, threads=page.items, next_cursor=page.next_cursor)
+
+
+@app.route('/api/course/<int:course_id>/threads')
+@login_required
+def forum_threads_json(course_id):
+    if not access.can_view(current_user.id, course_id):
+        abort(403)
+    page = thread_page(course_id, request.args.get('cursor'))
+    return jsonify({
+        'threads': [{
+            'id': thread.id,
+            'title': thread.title,
+            'content': thread.content,
+            'author': thread.user.username,
+            'created_at': thread.created_at.isoformat(),
+            'replies': thread.post_count
+        } for thread in page.items],
+        'next_cursor': page.next_cursor
+    })
 
 
 @app.route('/course/<int:course_id>/thread/new', methods=['GET', 'POST'])
 @login_required
 def new_thread(course_id):
     course = Course.query.get_or_404(course_id)
+    if not access.can_view(current_user.id, course_id):
+        abort(403)
 
     if request.method == 'POST':
         title = request.form.get('title')
@@ -499,21 +934,52 @@ def new_thread(course_id):
 @login_required
 def view_thread(thread_id):
     thread = ForumThread.query.get_or_404(thread_id)
-    return render_template('view_thread.html', thread=thread)
+    if not access.can_view(current_user.id, thread.course_id):
+        abort(403)
+    page = post_page(thread_id, request.args.get('cursor'))
+    return render_template('view_thread.html', thread=thread, posts=page.items, next_cursor=page.next_cursor)
+
+
+@app.route('/api/thread/<int:thread_id>/posts')
+@login_required
+def thread_posts_json(thread_id):
+    course_id = db.session.query(ForumThread.course_id).filter_by(id=thread_id).scalar()
+    if course_id is None:
+        abort(404)
+    if not access.can_view(current_user.id, course_id):
+        abort(403)
+    page = post_page(thread_id, request.args.get('cursor'))
+    return jsonify({
+        'posts': [{
+            'id': post.id,
+            'content': post.content,
+            'author': post.user.username,
+            'created_at': post.created_at.isoformat()
+        } for post in page.items],
+        'next_cursor': page.next_cursor
+    })
 
 
 @app.route('/thread/<int:thread_id>/post', methods=['POST'])
 @login_required
 def add_post(thread_id):
     thread = ForumThread.query.get_or_404(thread_id)
+    if not access.can_view(current_user.id, thread.course_id):
+        abort(403)
     content = request.form.get('content')
 
+    if write_behind.enabled:
+        write_behind.enqueue(ForumPost, owner_id=current_user.id,
+                             content=content, user_id=current_user.id, thread_id=thread_id)
+        return redirect(url_for('view_thread', thread_id=thread_id))
+
     post = ForumPost(
         content=content,
         user_id=current_user.id,
         thread_id=thread_id
     )
     db.session.add(post)
+    thread.post_count = ForumThread.post_count + 1
     db.session.commit()
 
     return redirect(url_for('view_thread', thread_id=thread_id))
@@ -523,39 +989,55 @@ def add_post(thread_id):
 @app.route('/search')
 def search():
     query = request.args.get('q', '')
+    category = request.args.get('category') or None
+    cursor = request.args.get('cursor')
+
     if query:
-        courses = Course.query.filter(
-            (Course.title.contains(query)) | (Course.description.contains(query))
-        ).all()
+        courses, total, next_cursor = search_courses(query, category=category, cursor=cursor,
+                                                     per_page=app.config['SEARCH_RESULTS_PER_PAGE'])
     else:
-        courses = []
-    return render_template('search_results.html', courses=courses, query=query)
+        courses, total, next_cursor = [], 0, None
+
+    return render_template('search_results.html', courses=courses, query=query, category=category,
+                           categories=search_categories.get(), total=total, cursor=cursor,
+                           next_cursor=next_cursor)
 
 
 # ==================== PROFILE ====================
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
+    # current_user is a cached principal; edits go through the full row
+    user = db.session.get(User, current_user.id)
     if request.method == 'POST':
-        current_user.username = request.form.get('username')
-        current_user.email = request.form.get('email')
+        if request.form.get('username') != user.username:
+            # Course cards show the instructor's name
+            Course.query.filter_by(instructor_id=user.id).update(
+                {Course.cache_version: Course.cache_version + 1}
+            )
+        user.username = request.form.get('username')
+        user.email = request.form.get('email')
 
         if request.form.get('new_password'):
-            if check_password_hash(current_user.password, request.form.get('current_password')):
-                current_user.password = generate_password_hash(request.form.get('new_password'))
+            if check_password_hash(user.password, request.form.get('current_password')):
+                user.password = generate_password_hash(request.form.get('new_password'))
                 flash('Password updated successfully!', 'success')
             else:
                 flash('Current password is incorrect!', 'danger')
                 return redirect(url_for('profile'))
 
         db.session.commit()
+        identities.invalidate(user.id)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile'))
 
-    return render_template('profile.html')
+    return render_template('profile.html', user=user)
 
 
 # ==================== TEMPLATE FILTERS ====================
+app.add_template_global(thumbnail_srcset)
+
+
 @app.template_filter('fromjson')
 def fromjson_filter(value):
     try:
@@ -0,0 +1,15 @@
+# backfill_completion.py
+from app import app
+from models import Enrollment
+from completion import rebuild_completion
+
+
+def backfill_completion():
+    with app.app_context():
+        rebuild_completion()
+        completed = Enrollment.query.filter_by(completed=True).count()
+        print(f"Recomputed course completion; {completed} enrollments are complete.")
+
+
+if __name__ == '__main__':
+    backfill_completion()
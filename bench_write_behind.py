@@ -0,0 +1,101 @@
+# bench_write_behind.py
+# Measures quiz submissions per second with write-behind batching off and on.
+# Runs against a throwaway SQLite database so it never touches instance/eduflow.db.
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+workdir = tempfile.mkdtemp(prefix='eduflow-bench-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+os.environ['WRITE_BEHIND_JOURNAL'] = os.path.join(workdir, 'write_behind.journal')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+from app import app, db, write_behind  # noqa: E402
+from models import User, Course, Module, Quiz, Question, QuizAttempt, Enrollment  # noqa: E402
+
+
+def setup_data(students):
+    with app.app_context():
+        db.create_all()
+        password = generate_password_hash('password123')
+        instructor = User(username='bench_instructor', email='instructor@example.com',
+                          password=password, is_instructor=True)
+        db.session.add(instructor)
+        db.session.flush()
+        course = Course(title='Bench', description='Benchmark course', instructor_id=instructor.id)
+        db.session.add(course)
+        db.session.flush()
+        module = Module(title='Module', order=1, course_id=course.id)
+        db.session.add(module)
+        db.session.flush()
+        quiz = Quiz(title='Quiz', module_id=module.id)
+        db.session.add(quiz)
+        db.session.flush()
+        for number in range(10):
+            db.session.add(Question(text=f'Question {number}', question_type='true_false',
+                                    correct_answer='True', points=1, quiz_id=quiz.id))
+        for number in range(students):
+            student = User(username=f'student{number}', email=f'student{number}@example.com', password=password)
+            db.session.add(student)
+            db.session.flush()
+            # take_quiz only accepts attempts from enrolled students
+            db.session.add(Enrollment(student_id=student.id, course_id=course.id))
+        course.enrollment_count = students
+        db.session.commit()
+        return quiz.id, [question.id for question in quiz.questions]
+
+
+def run_workload(quiz_id, question_ids, students, submissions):
+    answers = {f'question_{question_id}': 'True' for question_id in question_ids}
+    clients = []
+    for number in range(students):
+        client = app.test_client()
+        response = client.post('/login', data={'email': f'student{number}@example.com', 'password': 'password123'})
+        assert response.status_code == 302, 'login failed'
+        clients.append(client)
+
+    def submit(client):
+        for _ in range(submissions):
+            client.post(f'/quiz/{quiz_id}/take', data=answers)
+
+    threads = [threading.Thread(target=submit, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def count_attempts():
+    with app.app_context():
+        return QuizAttempt.query.count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quiz submission throughput with write-behind off and on')
+    parser.add_argument('--students', type=int, default=20, help='concurrent submitting students')
+    parser.add_argument('--submissions', type=int, default=50, help='submissions per student')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    quiz_id, question_ids = setup_data(args.students)
+    total = args.students * args.submissions
+
+    for enabled in (False, True):
+        if enabled:
+            write_behind.start()
+        before = count_attempts()
+        elapsed = run_workload(quiz_id, question_ids, args.students, args.submissions)
+        if enabled:
+            write_behind.stop()
+        assert count_attempts() - before == total
+
+        mode = 'on ' if enabled else 'off'
+        print(f"write-behind {mode}: {total} attempts in {elapsed:.2f}s ({total / elapsed:.0f} attempts/sec)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import uuid
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from models import db, Blob, insert_ignoring_conflicts
+from metrics import UPLOAD_BYTES
+
+BLOB_PREFIX = 'blobs'
+COPY_BLOCK_SIZE = 64 * 1024
+
+# Uploaded files are stored once per distinct content under
+# UPLOAD_FOLDER/blobs/<aa>/<bb>/<sha256><ext>. The two levels of fan-out keep every
+# directory small. The key (that relative path) is what Course.thumbnail,
+# Content.content_url and Submission.file_url hold, and Blob.ref_count counts
+# those references so gc_blobs.py can delete content nobody points at any more.
+
+
+def blob_key(sha256, filename):
+    extension = os.path.splitext(secure_filename(filename or ''))[1].lower()[:10]
+    return f'{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def is_blob_key(value):
+    return bool(value) and value.startswith(BLOB_PREFIX + '/')
+
+
+def blob_path(key):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *key.split('/'))
+
+
+def staging_path(name=None):
+    # Files are written here first and renamed into the store once hashed; the
+    # rename never copies because both live under UPLOAD_FOLDER.
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'incoming')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name or uuid.uuid4().hex)
+
+
+def put_file(source_path, sha256, filename):
+    # Move a fully written, hashed file into the store and return its key.
+    # If the content is already stored the new copy is simply discarded.
+    key = blob_key(sha256, filename)
+    destination = blob_path(key)
+    values = {'key': key, 'sha256': sha256, 'size': os.path.getsize(source_path), 'ref_count': 0}
+    statement = insert_ignoring_conflicts(Blob)
+    locked = None
+    while locked is None:
+        if statement is not None:
+            db.session.execute(statement.values(**values))
+        elif db.session.get(Blob, key) is None:
+            db.session.add(Blob(**values))
+        # The row stays locked until the caller commits its reference, and
+        # gc_blobs.py removes the file while holding the same lock, so the file
+        # check below cannot pass just before gc unlinks it. None means gc
+        # deleted the row between the insert and the lock; insert it again.
+        locked = db.session.execute(
+            db.select(Blob.key).where(Blob.key == key).with_for_update()
+        ).scalar()
+
+    if os.path.exists(destination):
+        os.remove(source_path)
+    else:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source_path, destination)
+    return key
+
+
+def put_stream(stream, filename):
+    # Hash and write a file object in one pass, then store it
+    hasher = hashlib.sha256()
+    temp_path = staging_path()
+    with open(temp_path, 'wb') as temp:
+        while True:
+            block = stream.read(COPY_BLOCK_SIZE)
+            if not block:
+                break
+            temp.write(block)
+            hasher.update(block)
+    return put_file(temp_path, hasher.hexdigest(), filename)
+
+
+def add_ref(key):
+    if is_blob_key(key):
+        db.session.execute(db.update(Blob).where(Blob.key == key).values(ref_count=Blob.ref_count + 1))
+
+
+def release(key):
+    if is_blob_key(key):
+        db.session.execute(db.update(Blob).where(Blob.key == key).values(ref_count=Blob.ref_count - 1))
+
+
+def store_upload(file_storage):
+    # Store a Werkzeug FileStorage and take a reference to it for the caller's record
+    key = put_stream(file_storage.stream, file_storage.filename)
+    UPLOAD_BYTES.inc(os.path.getsize(blob_path(key)))
+    add_ref(key)
+    return key
@@ -0,0 +1,217 @@
+import hashlib
+import io
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import reportlab
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from models import db, Certificate, Course, Enrollment, User
+from blobstore import put_file, add_ref, release, staging_path, blob_path, is_blob_key
+
+# Bump when the template artwork changes so cached template pages are redrawn
+TEMPLATE_VERSION = 1
+TEMPLATE_DPI = 200
+PAGE_WIDTH, PAGE_HEIGHT = landscape(letter)
+FONT_DIR = os.path.join(os.path.dirname(reportlab.__file__), 'fonts')
+NUMBER_PREFIX = 'EF-'
+INSERT_ATTEMPTS = 3
+
+
+def _font(name, points):
+    return ImageFont.truetype(os.path.join(FONT_DIR, name), int(points * TEMPLATE_DPI / 72))
+
+
+def _fit_lines(draw, text, font, max_width):
+    lines, line = [], ''
+    for word in text.split():
+        candidate = f'{line} {word}'.strip()
+        if line and draw.textlength(candidate, font=font) > max_width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    return lines + [line] if line else lines
+
+
+def render_template_page(path, course_title, instructor_name):
+    # Everything that is the same on every certificate of a course, drawn once as
+    # a page-sized JPEG that each PDF embeds as-is.
+    scale = TEMPLATE_DPI / 72
+    width, height = int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+
+    def y(points):
+        return int((PAGE_HEIGHT - points) * scale)
+
+    draw.rectangle([int(24 * scale), int(24 * scale), width - int(24 * scale), height - int(24 * scale)],
+                   outline=(13, 110, 253), width=int(4 * scale))
+    draw.rectangle([int(34 * scale), int(34 * scale), width - int(34 * scale), height - int(34 * scale)],
+                   outline=(13, 110, 253), width=int(1 * scale))
+
+    draw.text((width // 2, y(500)), 'Certificate of Completion', font=_font('VeraBd.ttf', 36),
+              fill=(33, 37, 41), anchor='ms')
+    draw.text((width // 2, y(455)), 'This certifies that', font=_font('Vera.ttf', 14),
+              fill=(108, 117, 125), anchor='ms')
+    draw.line([int(220 * scale), y(385), width - int(220 * scale), y(385)], fill=(173, 181, 189),
+              width=int(1 * scale))
+    draw.text((width // 2, y(350)), 'has successfully completed the course', font=_font('Vera.ttf', 14),
+              fill=(108, 117, 125), anchor='ms')
+
+    title_font = _font('VeraBd.ttf', 22)
+    for number, line in enumerate(_fit_lines(draw, course_title, title_font, width - int(200 * scale))[:2]):
+        draw.text((width // 2, y(315 - number * 28)), line, font=title_font, fill=(33, 37, 41), anchor='ms')
+
+    label_font = _font('Vera.ttf', 11)
+    draw.text((width // 2, y(235)), f'Instructor: {instructor_name}', font=_font('VeraIt.ttf', 13),
+              fill=(73, 80, 87), anchor='ms')
+    draw.text((int(150 * scale), y(110)), 'Date issued', font=label_font, fill=(108, 117, 125), anchor='ms')
+    draw.text((width - int(150 * scale), y(110)), 'Certificate No.', font=label_font,
+              fill=(108, 117, 125), anchor='ms')
+
+    temp_path = path + '.tmp'
+    image.save(temp_path, 'JPEG', quality=90, optimize=True)
+    os.replace(temp_path, path)
+
+
+def render_certificate(template_path, student_name, issued_on, certificate_number):
+    # Overlay the per-student fields on the course template. Pure function of its
+    # arguments (invariant output) so it can run in a worker process and identical
+    # inputs give byte-identical PDFs.
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output, pagesize=(PAGE_WIDTH, PAGE_HEIGHT), invariant=1)
+    pdf.setTitle(f'Certificate {certificate_number}')
+    pdf.drawImage(ImageReader(template_path), 0, 0, width=PAGE_WIDTH, height=PAGE_HEIGHT)
+
+    pdf.setFillColorRGB(0.13, 0.15, 0.16)
+    pdf.setFont('Times-BoldItalic', 32)
+    pdf.drawCentredString(PAGE_WIDTH / 2, 395, student_name)
+    pdf.setFont('Helvetica', 12)
+    pdf.drawCentredString(150, 125, issued_on)
+    pdf.drawCentredString(PAGE_WIDTH - 150, 125, certificate_number)
+
+    pdf.showPage()
+    pdf.save()
+    return output.getvalue()
+
+
+def _render_job(job):
+    return render_certificate(*job)
+
+
+def template_path_for(course):
+    instructor_name = course.instructor.username
+    digest = hashlib.sha256(f'{TEMPLATE_VERSION}|{course.title}|{instructor_name}'.encode()).hexdigest()
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'certificates', 'templates')
+    path = os.path.join(folder, f'{digest}.jpg')
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        render_template_page(path, course.title, instructor_name)
+    return path
+
+
+def allocate_numbers(count):
+    # Random numbers checked against the table in bulk; the unique constraint on
+    # certificate_number remains the final guard.
+    allocated = set()
+    while len(allocated) < count:
+        candidates = {NUMBER_PREFIX + secrets.token_hex(5).upper() for _ in range(count - len(allocated))}
+        candidates -= allocated
+        taken = {number for number, in db.session.query(Certificate.certificate_number).filter(
+            Certificate.certificate_number.in_(candidates)
+        )}
+        allocated |= candidates - taken
+    return list(allocated)
+
+
+def _store_pdf(pdf_bytes):
+    sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+    temp_path = staging_path()
+    with open(temp_path, 'wb') as temp:
+        temp.write(pdf_bytes)
+    key = put_file(temp_path, sha256, 'certificate.pdf')
+    add_ref(key)
+    return key
+
+
+def _has_file(certificate):
+    return is_blob_key(certificate.certificate_url) and os.path.isfile(blob_path(certificate.certificate_url))
+
+
+def _insert_certificates(course_id, student_ids):
+    # {student_id: Certificate}, adding rows for students who have none yet. A
+    # concurrent request issuing the same certificate (or a number collision)
+    # fails the insert on a unique constraint; the rows already there are then
+    # read back and only the students still missing one are retried.
+    for attempt in range(INSERT_ATTEMPTS):
+        existing = {
+            certificate.user_id: certificate
+            for certificate in Certificate.query.filter(
+                Certificate.course_id == course_id, Certificate.user_id.in_(student_ids)
+            )
+        }
+        new_students = [student_id for student_id in student_ids if student_id not in existing]
+        if not new_students:
+            return existing
+        now = datetime.utcnow()
+        numbers = allocate_numbers(len(new_students))
+        try:
+            with db.session.begin_nested():
+                for student_id, number in zip(new_students, numbers):
+                    certificate = Certificate(user_id=student_id, course_id=course_id,
+                                              certificate_number=number, issued_at=now)
+                    db.session.add(certificate)
+                    existing[student_id] = certificate
+            return existing
+        except IntegrityError:
+            if attempt == INSERT_ATTEMPTS - 1:
+                raise
+
+
+def issue_certificates(course, student_ids, workers=None):
+    # Issue (or re-render missing files for) certificates for the given students of
+    # one course. Returns the Certificate rows.
+    existing = _insert_certificates(course.id, student_ids)
+
+    pending = [certificate for certificate in existing.values() if not _has_file(certificate)]
+    if pending:
+        names = dict(db.session.query(User.id, User.username).filter(
+            User.id.in_([certificate.user_id for certificate in pending])
+        ))
+        template_path = template_path_for(course)
+        jobs = [
+            (template_path, names[certificate.user_id], certificate.issued_at.strftime('%B %d, %Y'),
+             certificate.certificate_number)
+            for certificate in pending
+        ]
+        if workers == 1 or len(jobs) == 1:
+            rendered = list(map(_render_job, jobs))
+        else:
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rendered = list(pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+        for certificate, pdf_bytes in zip(pending, rendered):
+            release(certificate.certificate_url)
+            certificate.certificate_url = _store_pdf(pdf_bytes)
+
+    db.session.commit()
+    return list(existing.values())
+
+
+def issue_certificate(enrollment):
+    course = db.session.get(Course, enrollment.course_id)
+    return issue_certificates(course, [enrollment.student_id], workers=1)[0]
+
+
+def completed_student_ids(course_id):
+    return [student_id for student_id, in db.session.query(Enrollment.student_id).filter_by(
+        course_id=course_id, completed=True
+    )]
@@ -0,0 +1,201 @@
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Course, Module, Content, Quiz, Assignment, Enrollment
+from models import ContentCompletion, QuizCompletion, AssignmentCompletion, QuizAttempt, Submission
+from models import insert_ignoring_conflicts, insert_or_ignore
+
+# A course is complete once an enrollment's completed_item_count reaches the
+# course's required_item_count. Items are the course's contents (marked
+# complete), quizzes (at least one passing attempt) and assignments (at least
+# one graded submission); each completed item has one row in ContentCompletion,
+# QuizCompletion or AssignmentCompletion, and only the request that inserts that
+# row increments the counter. Both counters are kept up to date one event at a time,
+# so nothing ever recounts a whole course on the request path; rebuild_completion()
+# recomputes them from the underlying rows.
+
+DEFAULT_PASSING_SCORE = 70
+
+
+def record_item_completed(student_id, course_id, count=1):
+    # One UPDATE: bump the counter and flip `completed` when it reaches the target.
+    # SET expressions see the row's old values, hence the `+ count` in the comparison.
+    required = db.select(Course.required_item_count).where(Course.id == course_id).scalar_subquery()
+    reached = db.and_(Enrollment.completed_item_count + count >= required, required > 0)
+    newly_completed = db.and_(reached, Enrollment.completed.isnot(True))
+    db.session.execute(db.update(Enrollment).where(
+        Enrollment.student_id == student_id,
+        Enrollment.course_id == course_id
+    ).values(
+        completed_item_count=Enrollment.completed_item_count + count,
+        completed=db.case((reached, True), else_=Enrollment.completed),
+        completed_at=db.case((newly_completed, datetime.utcnow()), else_=Enrollment.completed_at)
+    ).execution_options(synchronize_session=False))
+
+
+def insert_completion(user_id, content_id, course_id):
+    # INSERT ... SELECT guarded by the enrollment and skipping an existing row, so
+    # one statement both authorises and records the completion. Returns True when
+    # a row was inserted.
+    now = datetime.utcnow()
+    enrolled = db.select(Enrollment.id).where(
+        Enrollment.student_id == user_id,
+        Enrollment.course_id == course_id
+    ).exists()
+    statement = insert_ignoring_conflicts(ContentCompletion)
+    if statement is None:
+        if not db.session.query(enrolled).scalar():
+            return False
+        try:
+            with db.session.begin_nested():
+                db.session.add(ContentCompletion(user_id=user_id, content_id=content_id, completed_at=now))
+            return True
+        except IntegrityError:
+            return False
+
+    rows = db.select(db.literal(user_id), db.literal(content_id), db.literal(now)).where(enrolled)
+    statement = statement.from_select(['user_id', 'content_id', 'completed_at'], rows)
+    return db.session.execute(statement).rowcount > 0
+
+
+def insert_completions(rows):
+    # Insert many completion rows in one statement, skipping any that already exist.
+    # Returns the content ids actually inserted.
+    if not rows:
+        return set()
+    statement = insert_ignoring_conflicts(ContentCompletion)
+    if statement is None:
+        inserted = set()
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(ContentCompletion(**row))
+                inserted.add(row['content_id'])
+            except IntegrityError:
+                pass
+        return inserted
+    result = db.session.execute(statement.values(rows).returning(ContentCompletion.content_id))
+    return {content_id for content_id, in result}
+
+
+def _required_items():
+    def count(model):
+        return db.select(db.func.count(model.id)).join(
+            Module, model.module_id == Module.id
+        ).where(Module.course_id == Course.id).scalar_subquery()
+
+    return count(Content) + count(Quiz) + count(Assignment)
+
+
+def _completed_items():
+    contents = db.select(db.func.count(ContentCompletion.id)).join(
+        Content, ContentCompletion.content_id == Content.id
+    ).join(
+        Module, Content.module_id == Module.id
+    ).where(
+        Module.course_id == Enrollment.course_id,
+        ContentCompletion.user_id == Enrollment.student_id
+    ).scalar_subquery()
+    quizzes = db.select(db.func.count(QuizCompletion.id)).join(
+        Quiz, QuizCompletion.quiz_id == Quiz.id
+    ).join(
+        Module, Quiz.module_id == Module.id
+    ).where(
+        Module.course_id == Enrollment.course_id,
+        QuizCompletion.user_id == Enrollment.student_id
+    ).scalar_subquery()
+    assignments = db.select(db.func.count(AssignmentCompletion.id)).join(
+        Assignment, AssignmentCompletion.assignment_id == Assignment.id
+    ).join(
+        Module, Assignment.module_id == Module.id
+    ).where(
+        Module.course_id == Enrollment.course_id,
+        AssignmentCompletion.user_id == Enrollment.student_id
+    ).scalar_subquery()
+    return contents + quizzes + assignments
+
+
+def _mark_completed(*criteria):
+    required = db.select(Course.required_item_count).where(Course.id == Enrollment.course_id).scalar_subquery()
+    db.session.execute(db.update(Enrollment).where(
+        Enrollment.completed.isnot(True),
+        Enrollment.completed_item_count >= required,
+        required > 0,
+        *criteria
+    ).values(completed=True, completed_at=datetime.utcnow()).execution_options(synchronize_session=False))
+
+
+def refresh_enrollments(pairs):
+    # Recount specific (student_id, course_id) enrollments, for batches written
+    # behind the request where the per-event increments cannot tell duplicates apart
+    for student_id, course_id in set(pairs):
+        criteria = (Enrollment.student_id == student_id, Enrollment.course_id == course_id)
+        db.session.execute(db.update(Enrollment).where(*criteria).values(
+            completed_item_count=_completed_items()
+        ).execution_options(synchronize_session=False))
+        _mark_completed(*criteria)
+
+
+def _refresh_rows(rows, model, key):
+    course_ids = dict(db.session.query(model.id, Module.course_id).join(
+        Module, model.module_id == Module.id
+    ).filter(model.id.in_({row[key] for row in rows})))
+    refresh_enrollments(
+        (row['user_id'], course_ids[row[key]]) for row in rows if row[key] in course_ids
+    )
+
+
+def refresh_content_rows(rows):
+    _refresh_rows(rows, Content, 'content_id')
+
+
+def refresh_quiz_rows(rows):
+    # Attempts written behind the request record their quiz completions here, before the recount
+    passing_scores = dict(db.session.query(
+        Quiz.id, db.func.coalesce(Quiz.passing_score, DEFAULT_PASSING_SCORE)
+    ).filter(Quiz.id.in_({row['quiz_id'] for row in rows})))
+    for row in rows:
+        passing_score = passing_scores.get(row['quiz_id'])
+        if passing_score is not None and row['score'] is not None and row['score'] >= passing_score:
+            insert_or_ignore(QuizCompletion, user_id=row['user_id'], quiz_id=row['quiz_id'],
+                             completed_at=row['completed_at'])
+    _refresh_rows(rows, Quiz, 'quiz_id')
+
+
+def _backfill_item_completions():
+    # Completion rows for passing attempts and graded submissions that have none,
+    # e.g. recorded before QuizCompletion and AssignmentCompletion existed
+    passed = db.select(
+        QuizAttempt.user_id, QuizAttempt.quiz_id, db.func.min(QuizAttempt.completed_at)
+    ).join(Quiz, QuizAttempt.quiz_id == Quiz.id).where(
+        QuizAttempt.score >= db.func.coalesce(Quiz.passing_score, DEFAULT_PASSING_SCORE),
+        ~db.select(QuizCompletion.id).where(
+            QuizCompletion.user_id == QuizAttempt.user_id,
+            QuizCompletion.quiz_id == QuizAttempt.quiz_id
+        ).exists()
+    ).group_by(QuizAttempt.user_id, QuizAttempt.quiz_id)
+    db.session.execute(db.insert(QuizCompletion).from_select(['user_id', 'quiz_id', 'completed_at'], passed))
+
+    graded = db.select(
+        Submission.user_id, Submission.assignment_id, db.func.min(Submission.graded_at)
+    ).where(
+        Submission.score.isnot(None),
+        ~db.select(AssignmentCompletion.id).where(
+            AssignmentCompletion.user_id == Submission.user_id,
+            AssignmentCompletion.assignment_id == Submission.assignment_id
+        ).exists()
+    ).group_by(Submission.user_id, Submission.assignment_id)
+    db.session.execute(db.insert(AssignmentCompletion).from_select(
+        ['user_id', 'assignment_id', 'completed_at'], graded
+    ))
+
+
+def rebuild_completion():
+    # Backfill: the item completion rows, then three set-based UPDATEs over every
+    # course and enrollment
+    _backfill_item_completions()
+    db.session.execute(db.update(Course).values(required_item_count=_required_items()))
+    db.session.execute(db.update(Enrollment).values(completed_item_count=_completed_items()))
+    _mark_completed()
+    db.session.commit()
@@ -1,10 +1,71 @@
 import os
 from datetime import timedelta
 
+basedir = os.path.dirname(os.path.abspath(__file__))
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///eduflow.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+
+    # Engine tuning per database (see engine_profiles.py): auto, sqlite, postgresql or none
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'auto')
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SINGLE_WRITER = os.environ.get('SQLITE_SINGLE_WRITER', 'true').lower() == 'true'  # queue writers in-process
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))  # 0 disables
+    UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max file size
-    PERMANENT_SESSION_LIFETIME = timedelta(days=7)
\ No newline at end of file
+    MAX_UPLOAD_SIZE = MAX_CONTENT_LENGTH  # largest file accepted by the chunked upload API
+    THUMBNAIL_WIDTHS = (320, 640, 960, 1280)
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+    BLOB_GC_GRACE_HOURS = 24  # unreferenced blobs and abandoned uploads younger than this are kept
+    PERMANENT_SESSION_LIFETIME = timedelta(days=7)
+    MEDIA_MAX_AGE = 3600  # seconds browsers may reuse a served upload before revalidating
+    MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX')  # e.g. /protected-uploads
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+    QUIZ_KEY_CACHE_TTL = int(os.environ.get('QUIZ_KEY_CACHE_TTL', 300))  # seconds
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))  # seconds other workers may see an old profile
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+    ACCESS_CACHE_TTL = int(os.environ.get('ACCESS_CACHE_TTL', 300))  # seconds; enrolled/owned course ids per user
+    ACCESS_CACHE_SIZE = int(os.environ.get('ACCESS_CACHE_SIZE', 10000))
+    PROGRESS_BATCH_MAX_EVENTS = 500
+    SEARCH_RESULTS_PER_PAGE = 12
+    COURSES_PER_PAGE = 50
+    FORUM_THREADS_PER_PAGE = 20
+    FORUM_POSTS_PER_PAGE = 50
+
+    # Rendered course cards and outlines: an in-process LRU of this many fragments,
+    # plus a shared tier on disk for all worker processes when FRAGMENT_CACHE_DIR is set
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 2000))
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR')
+
+    # Per-request SQL timing: Server-Timing headers, slow-query and N+1 warnings
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))  # repeats of one statement shape
+    DEBUG_PANEL_ENABLED = os.environ.get('DEBUG_PANEL_ENABLED', 'false').lower() == 'true'
+
+    # Prometheus metrics at /metrics. Under gunicorn point METRICS_MULTIPROC_DIR at a
+    # directory shared by the workers (emptied before the server starts).
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # require "Authorization: Bearer <token>" when set
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_DUMP_INTERVAL = float(os.environ.get('METRICS_DUMP_INTERVAL', 5))  # seconds
+
+    # Write-behind batching for quiz attempts, content completions and forum posts
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    # Each process journals to "<WRITE_BEHIND_JOURNAL>.<pid>"
+    WRITE_BEHIND_JOURNAL = os.environ.get('WRITE_BEHIND_JOURNAL') or os.path.join(basedir, 'instance', 'write_behind.journal')
+    WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 200))
+    WRITE_BEHIND_MAX_LATENCY = float(os.environ.get('WRITE_BEHIND_MAX_LATENCY', 0.25))  # seconds
+    WRITE_BEHIND_FSYNC = os.environ.get('WRITE_BEHIND_FSYNC', 'false').lower() == 'true'
+    # Rewrite a journal that never drains once it grows past this many bytes
+    WRITE_BEHIND_COMPACT_BYTES = int(os.environ.get('WRITE_BEHIND_COMPACT_BYTES', 4 * 1024 * 1024))
\ No newline at end of file
@@ -0,0 +1,256 @@
+import io
+import json
+import os
+import posixpath
+import time
+import zipfile
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Course, Module, Content, Quiz, Question, Assignment, User, Blob
+from blobstore import put_stream, blob_path, is_blob_key
+from search import index_course
+
+FORMAT = 'eduflow-course-package'
+VERSION = 1
+FETCH_SIZE = 1000
+
+# A course package is a zip holding manifest.json, one courses/<id>.jsonl per
+# course and the uploaded files those courses point at under media/. Each course
+# file is a stream of {"type": ..., <columns>} records, parents before children:
+# course, module, content, quiz, question, assignment. Blob keys are kept as they
+# are; the media entry for blobs/ab/cd/<sha256>.png is media/<sha256>.png.
+
+# (record type, model, parent column, parent type) in insert order
+RECORD_TYPES = [
+    ('course', Course, None, None),
+    ('module', Module, 'course_id', 'course'),
+    ('content', Content, 'module_id', 'module'),
+    ('quiz', Quiz, 'module_id', 'module'),
+    ('question', Question, 'quiz_id', 'quiz'),
+    ('assignment', Assignment, 'module_id', 'module'),
+]
+# Counters are recomputed on import; the instructor travels as an email address
+SKIPPED_COLUMNS = {'enrollment_count', 'module_count', 'required_item_count', 'cache_version', 'instructor_id'}
+MEDIA_COLUMNS = {'course': 'thumbnail', 'content': 'content_url'}
+
+
+class PackageError(Exception):
+    pass
+
+
+def _columns(model):
+    return [column for column in model.__table__.columns if column.key not in SKIPPED_COLUMNS]
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _decode(model, record):
+    # Every row of a bulk insert needs the same keys, so absent columns get their defaults
+    row = {}
+    for column in _columns(model):
+        if column.key in record:
+            value = record[column.key]
+            if value is not None and isinstance(column.type, db.DateTime):
+                value = datetime.fromisoformat(value)
+            row[column.key] = value
+        elif column.key != 'id':
+            default = column.default
+            row[column.key] = None if default is None else default.arg(None) if default.is_callable else default.arg
+    return row
+
+
+def media_name(key):
+    return 'media/' + posixpath.basename(key)
+
+
+def _course_records(course_id):
+    # Stream one course's rows without loading its tree into the session
+    course = db.session.execute(
+        db.select(Course, User.email).join(User, Course.instructor_id == User.id).where(Course.id == course_id)
+    ).one_or_none()
+    if course is None:
+        raise PackageError(f'Course {course_id} does not exist')
+    record = {column.key: _encode(getattr(course[0], column.key)) for column in _columns(Course)}
+    yield {'type': 'course', 'instructor_email': course[1], **record}
+
+    module_ids = db.select(Module.id).where(Module.course_id == course_id).scalar_subquery()
+    quiz_ids = db.select(Quiz.id).where(Quiz.module_id.in_(module_ids)).scalar_subquery()
+    filters = {
+        'module': Module.course_id == course_id,
+        'content': Content.module_id.in_(module_ids),
+        'quiz': Quiz.module_id.in_(module_ids),
+        'question': Question.quiz_id.in_(quiz_ids),
+        'assignment': Assignment.module_id.in_(module_ids),
+    }
+    for record_type, model, _, _ in RECORD_TYPES[1:]:
+        columns = _columns(model)
+        result = db.session.execute(
+            db.select(*columns).where(filters[record_type]).order_by(model.id).execution_options(yield_per=FETCH_SIZE)
+        )
+        for row in result:
+            yield {'type': record_type, **{column.key: _encode(value) for column, value in zip(columns, row)}}
+
+
+def export_courses(course_ids, output, include_media=True):
+    # Write a package to a binary file object. It may be unseekable (a pipe or an
+    # HTTP response); entries are written one after another as they are read.
+    written_media = set()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for course_id in course_ids:
+            media = []
+            info = zipfile.ZipInfo(f'courses/{course_id}.jsonl', date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w') as entry:
+                for record in _course_records(course_id):
+                    entry.write(json.dumps(record).encode('utf-8') + b'\n')
+                    key = record.get(MEDIA_COLUMNS.get(record['type']))
+                    if is_blob_key(key):
+                        media.append(key)
+            for key in media:
+                path = blob_path(key)
+                if include_media and key not in written_media and os.path.isfile(path):
+                    # Uploaded media is mostly compressed already
+                    archive.write(path, media_name(key), compress_type=zipfile.ZIP_STORED)
+                    written_media.add(key)
+            db.session.expunge_all()
+        archive.writestr('manifest.json', json.dumps({
+            'format': FORMAT,
+            'version': VERSION,
+            'exported_at': datetime.utcnow().isoformat(),
+            'courses': len(course_ids),
+        }))
+
+
+def _read_course(archive, name):
+    records = {record_type: [] for record_type, _, _, _ in RECORD_TYPES}
+    with archive.open(name) as entry:
+        for number, line in enumerate(io.TextIOWrapper(entry, encoding='utf-8'), 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                records[record['type']].append(record)
+            except (ValueError, KeyError, TypeError):
+                raise PackageError(f'{name}, line {number}: not a course package record')
+    if len(records['course']) != 1:
+        raise PackageError(f'{name}: expected exactly one course record')
+    return records
+
+
+def _store_media(archive, key):
+    # Make sure the blob behind a key exists, copying it out of the package if needed
+    if os.path.isfile(blob_path(key)) and db.session.get(Blob, key) is not None:
+        return
+    name = media_name(key)
+    try:
+        with archive.open(name) as stream:
+            stored_key = put_stream(stream, posixpath.basename(key))
+    except KeyError:
+        raise PackageError(f'{name} is missing from the package')
+    if stored_key != key:
+        raise PackageError(f'{name} does not match its checksum')
+
+
+def import_course_records(records, instructor_id=None, preserve_ids=False, archive=None):
+    # Insert one course tree with a bulk INSERT per table, inside the caller's
+    # transaction. Without preserve_ids every row gets a fresh id and the parent
+    # columns are remapped. Returns the new course id.
+    course_record = records['course'][0]
+    email = course_record.get('instructor_email')
+    if email:
+        instructor_id = db.session.query(User.id).filter_by(email=email).scalar() or instructor_id
+    if instructor_id is None:
+        raise PackageError(f'No instructor for course "{course_record.get("title")}"')
+
+    id_maps = {}
+    for record_type, model, parent_column, parent_type in RECORD_TYPES:
+        if not records[record_type]:
+            continue
+        rows = []
+        for record in records[record_type]:
+            row = _decode(model, record)
+            if not preserve_ids:
+                row.pop('id', None)
+            if parent_column:
+                try:
+                    row[parent_column] = id_maps[parent_type][record[parent_column]]
+                except KeyError:
+                    raise PackageError(f'{record_type} {record.get("id")} refers to a missing {parent_type}')
+            rows.append(row)
+        if record_type == 'course':
+            rows[0].update(
+                instructor_id=instructor_id,
+                module_count=len(records['module']),
+                required_item_count=len(records['content']) + len(records['quiz']) + len(records['assignment']),
+            )
+        if record_type == 'question':
+            # Nothing refers to questions, so there is no need to read their ids back
+            db.session.execute(db.insert(model), rows)
+            continue
+        new_ids = db.session.execute(
+            db.insert(model).returning(model.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        id_maps[record_type] = {record.get('id'): new_id for record, new_id in zip(records[record_type], new_ids)}
+
+    references = {}
+    for record_type, column in MEDIA_COLUMNS.items():
+        for record in records[record_type]:
+            key = record.get(column)
+            if is_blob_key(key):
+                references[key] = references.get(key, 0) + 1
+    for key, count in references.items():
+        if archive is not None:
+            _store_media(archive, key)
+        db.session.execute(db.update(Blob).where(Blob.key == key).values(ref_count=Blob.ref_count + count))
+
+    course_id = id_maps['course'][course_record.get('id')]
+    index_course(course_id)
+    return course_id
+
+
+def _sync_sequences():
+    # Explicit ids do not advance PostgreSQL sequences
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for _, model, _, _ in RECORD_TYPES:
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+        ))
+    db.session.commit()
+
+
+def import_package(source, instructor_id=None, preserve_ids=False):
+    # Import every course in a package, committing each course on its own.
+    # Returns ([(package course id, new course id)], [(entry name, error)]).
+    imported, failed = [], []
+    with zipfile.ZipFile(source) as archive:
+        try:
+            manifest = json.loads(archive.read('manifest.json'))
+        except (KeyError, ValueError):
+            raise PackageError('Not a course package: manifest.json is missing or invalid')
+        if manifest.get('format') != FORMAT or manifest.get('version', 0) > VERSION:
+            raise PackageError(f'Unsupported package format {manifest.get("format")} v{manifest.get("version")}')
+
+        for name in archive.namelist():
+            if not (name.startswith('courses/') and name.endswith('.jsonl')):
+                continue
+            try:
+                records = _read_course(archive, name)
+                course_id = import_course_records(records, instructor_id, preserve_ids, archive)
+                db.session.commit()
+                imported.append((records['course'][0].get('id'), course_id))
+            except (PackageError, IntegrityError) as e:
+                db.session.rollback()
+                failed.append((name, str(e).splitlines()[0]))
+            db.session.expunge_all()
+
+    if preserve_ids and imported:
+        _sync_sequences()
+    return imported, failed
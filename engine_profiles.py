@@ -0,0 +1,111 @@
+import re
+import sqlite3
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import Pool
+
+# Engine settings per database, chosen with DB_PROFILE ('auto' picks by the URL).
+#
+# sqlite: WAL so readers never wait for the writer, synchronous=NORMAL (durable
+# at checkpoints, safe against corruption), a memory-mapped read path and a busy
+# timeout instead of failing at once with "database is locked". SQLite allows one
+# writer at a time; threads that all start writing together end up in its busy
+# handler, which sleeps in growing steps. The single-writer queue makes them
+# queue on a lock instead, taken at a transaction's first write and released at
+# commit or rollback. Reads (outside any transaction under pysqlite) never wait.
+#
+# postgresql: a sized connection pool with pre-ping and recycling, and a
+# server-side statement_timeout so a runaway query cannot hold a connection.
+
+WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+PROFILES = ('sqlite', 'postgresql', 'none')
+
+_writer_lock = threading.RLock()
+_settings = {}
+
+
+def profile_name(config):
+    profile = config['DB_PROFILE']
+    if profile == 'auto':
+        backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+        return backend if backend in PROFILES else 'none'
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE {profile!r}; expected auto or one of {", ".join(PROFILES)}')
+    return profile
+
+
+def engine_options(config):
+    # SQLALCHEMY_ENGINE_OPTIONS for the profile, on top of any set explicitly
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    profile = profile_name(config)
+    if profile == 'sqlite':
+        # pysqlite's own busy handler, in seconds
+        options.setdefault('connect_args', {}).setdefault('timeout', config['SQLITE_BUSY_TIMEOUT_MS'] / 1000)
+    elif profile == 'postgresql':
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', True)
+        if config['DB_STATEMENT_TIMEOUT_MS']:
+            options.setdefault('connect_args', {}).setdefault(
+                'options', f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT_MS'])}"
+            )
+    return options
+
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={_settings['journal_mode']}")
+    cursor.execute(f"PRAGMA synchronous={_settings['synchronous']}")
+    cursor.execute(f"PRAGMA mmap_size={int(_settings['mmap_size'])}")
+    cursor.execute(f"PRAGMA busy_timeout={int(_settings['busy_timeout_ms'])}")
+    cursor.close()
+
+
+def _acquire_writer(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name != 'sqlite' or conn.info.get('holds_writer_lock') or not WRITE_STATEMENT.match(statement):
+        return
+    # Give up waiting after the busy timeout and let SQLite report the conflict
+    if _writer_lock.acquire(timeout=_settings['busy_timeout_ms'] / 1000):
+        conn.info['holds_writer_lock'] = True
+
+
+def _release_writer(info):
+    if info.pop('holds_writer_lock', False):
+        _writer_lock.release()
+
+
+def _release_on_end(conn):
+    _release_writer(conn.info)
+
+
+def _release_on_reset(dbapi_connection, connection_record, reset_state):
+    # Connections returned to the pool mid-transaction are rolled back there
+    _release_writer(connection_record.info)
+
+
+def init_engine_profile(app):
+    # Call before db.init_app(app): the options are read when the engine is created
+    profile = profile_name(app.config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    if profile != 'sqlite' or _settings:
+        return profile
+
+    _settings.update(
+        journal_mode=app.config['SQLITE_JOURNAL_MODE'],
+        synchronous=app.config['SQLITE_SYNCHRONOUS'],
+        mmap_size=app.config['SQLITE_MMAP_SIZE'],
+        busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS'],
+    )
+    event.listen(Pool, 'connect', _sqlite_connect)
+    if app.config['SQLITE_SINGLE_WRITER']:
+        event.listen(Engine, 'before_cursor_execute', _acquire_writer)
+        event.listen(Engine, 'commit', _release_on_end)
+        event.listen(Engine, 'rollback', _release_on_end)
+        event.listen(Pool, 'reset', _release_on_reset)
+    return profile
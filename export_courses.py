@@ -0,0 +1,31 @@
+# export_courses.py
+import argparse
+import sys
+import time
+
+from app import app, db
+from models import Course
+from course_packages import export_courses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export courses as a course package (zip)')
+    parser.add_argument('output', help='package file to write, or - for standard output')
+    parser.add_argument('course_ids', type=int, nargs='*', help='courses to export (default: all)')
+    parser.add_argument('--no-media', action='store_true', help='leave uploaded files out of the package')
+    args = parser.parse_args()
+
+    with app.app_context():
+        course_ids = args.course_ids or [course_id for course_id, in db.session.query(Course.id).order_by(Course.id)]
+        started = time.perf_counter()
+        if args.output == '-':
+            export_courses(course_ids, sys.stdout.buffer, include_media=not args.no_media)
+        else:
+            with open(args.output, 'wb') as output:
+                export_courses(course_ids, output, include_media=not args.no_media)
+        print(f"Exported {len(course_ids)} courses in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
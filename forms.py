@@ -4,6 +4,11 @@ from wtforms import StringField, TextAreaField, SelectField, IntegerField, Boole
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError
 from models import User
 
+# File types accepted for course thumbnails and assignment submissions, whichever
+# way they are uploaded (form field or the chunked upload API)
+THUMBNAIL_EXTENSIONS = ['jpg', 'png', 'jpeg', 'gif']
+SUBMISSION_EXTENSIONS = ['pdf', 'doc', 'docx', 'odt', 'txt', 'md', 'zip', 'jpg', 'jpeg', 'png', 'gif']
+
 
 class RegistrationForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
@@ -33,7 +38,7 @@ class CourseForm(FlaskForm):
     title = StringField('Course Title', validators=[DataRequired()])
     description = TextAreaField('Description', validators=[DataRequired()])
     category = StringField('Category')
-    thumbnail = FileField('Thumbnail', validators=[FileAllowed(['jpg', 'png', 'jpeg', 'gif'])])
+    thumbnail = FileField('Thumbnail', validators=[FileAllowed(THUMBNAIL_EXTENSIONS)])
     submit = SubmitField('Create Course')
 
 
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+# Rendered HTML for parts of a page that are the same for every visitor (course
+# cards, course outlines). Each fragment has a name such as "course-card:12" and
+# a version; Course.cache_version is bumped whenever what a course's fragments
+# show changes, so a stale entry is simply never asked for again. Only one
+# version per name is kept in each tier, which bounds the shared tier on disk.
+
+
+class FileFragmentStore:
+    # Shared tier: one file per fragment name, "<version>\n<html>", written
+    # atomically so every worker process (and restarts) can reuse it
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, name, version):
+        try:
+            with open(self._path(name), encoding='utf-8') as entry:
+                stored_version = entry.readline().rstrip('\n')
+                return entry.read() if stored_version == version else None
+        except OSError:
+            return None
+
+    def set(self, name, version, html):
+        path = self._path(name)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as entry:
+                entry.write(f'{version}\n{html}')
+            os.replace(temp_path, path)
+        except OSError:
+            current_app.logger.warning('Could not write fragment %s to the shared cache', name)
+
+
+class FragmentCache:
+    def __init__(self, max_entries=2000, shared=None):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # name -> (version, html), least recently used first
+        self._lock = threading.Lock()
+        self._template_digests = {}
+
+    def _template_digest(self, template):
+        # Part of every version, so a deploy that edits a fragment template never
+        # serves markup rendered from the old one
+        digest = self._template_digests.get(template)
+        if digest is None:
+            source = current_app.jinja_env.loader.get_source(current_app.jinja_env, template)[0]
+            digest = self._template_digests[template] = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+        return digest
+
+    def get(self, name, version):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(name)
+                return entry[1]
+        if self.shared is not None:
+            html = self.shared.get(name, version)
+            if html is not None:
+                self._store_local(name, version, html)
+            return html
+        return None
+
+    def _store_local(self, name, version, html):
+        with self._lock:
+            self._entries[name] = (version, html)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, name, version, html):
+        self._store_local(name, version, html)
+        if self.shared is not None:
+            self.shared.set(name, version, html)
+
+    def render(self, name, version, template, load_context):
+        # load_context() is only called on a miss, so the queries behind the
+        # fragment are skipped along with the rendering
+        version = f'{version}-{self._template_digest(template)}'
+        html = self.get(name, version)
+        if html is None:
+            self.misses += 1
+            html = render_template(template, **load_context())
+            self.set(name, version, html)
+        else:
+            self.hits += 1
+        return Markup(html)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def create_fragment_cache(app):
+    directory = app.config['FRAGMENT_CACHE_DIR']
+    return FragmentCache(
+        max_entries=app.config['FRAGMENT_CACHE_SIZE'],
+        shared=FileFragmentStore(directory) if directory else None,
+    )
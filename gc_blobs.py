@@ -0,0 +1,126 @@
+# gc_blobs.py
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import Blob, Certificate, Course, Content, Submission, Upload
+from blobstore import BLOB_PREFIX, blob_path, is_blob_key, put_stream, staging_path
+from thumbnails import source_digest
+
+# (model, column) pairs that may hold a blob key
+REFERENCES = [
+    (Course, Course.thumbnail),
+    (Content, Content.content_url),
+    (Submission, Submission.file_url),
+    (Certificate, Certificate.certificate_url),
+]
+
+
+def recount_references():
+    counts = [
+        db.select(db.func.count()).select_from(model).where(column == Blob.key).scalar_subquery()
+        for model, column in REFERENCES
+    ]
+    db.session.execute(db.update(Blob).values(ref_count=sum(counts)))
+    db.session.commit()
+
+
+def adopt_legacy_files():
+    # Move files saved before the blob store existed (uuid_name in UPLOAD_FOLDER)
+    # into it, so identical legacy uploads collapse into one copy.
+    upload_folder = app.config['UPLOAD_FOLDER']
+    adopted = 0
+    for model, column in REFERENCES:
+        for record in model.query.filter(column.isnot(None), column != '').all():
+            value = getattr(record, column.key)
+            path = os.path.join(upload_folder, value)
+            if is_blob_key(value) or os.path.dirname(value) or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as legacy:
+                setattr(record, column.key, put_stream(legacy, value))
+            db.session.commit()
+            os.remove(path)
+            adopted += 1
+    print(f"Adopted {adopted} legacy uploads into the blob store.")
+
+
+def collect_garbage(grace):
+    cutoff = datetime.utcnow() - grace
+    recent_uploads = db.select(Upload.stored_name).where(Upload.created_at >= cutoff)
+
+    unreferenced = (
+        Blob.ref_count <= 0,
+        Blob.created_at < cutoff,
+        Blob.key.notin_(recent_uploads)
+    )
+    deleted = 0
+    for key, in db.session.query(Blob.key).filter(*unreferenced).all():
+        # put_file/store_upload may have deduplicated onto this blob since the
+        # recount; the conditions are checked again by the DELETE itself. The file
+        # is removed before the commit, while the deleted row is still locked, so
+        # a concurrent put_file waits and then finds the file gone and rewrites it.
+        result = db.session.execute(db.delete(Blob).where(Blob.key == key, *unreferenced))
+        if result.rowcount:
+            path = blob_path(key)
+            if os.path.exists(path):
+                os.remove(path)
+            deleted += 1
+        db.session.commit()
+    print(f"Deleted {deleted} unreferenced blobs.")
+
+    # Chunked uploads that were started but never finished
+    abandoned = Upload.query.filter(Upload.completed_at.is_(None), Upload.created_at < cutoff).all()
+    for upload in abandoned:
+        path = staging_path(upload.id)
+        if os.path.exists(path):
+            os.remove(path)
+        db.session.delete(upload)
+    db.session.commit()
+    print(f"Deleted {len(abandoned)} abandoned uploads.")
+
+    # Files left behind by a crash between writing a blob and recording it
+    known = {key for key, in db.session.query(Blob.key)}
+    root = os.path.join(app.config['UPLOAD_FOLDER'], BLOB_PREFIX)
+    stray = 0
+    for folder, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            key = os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+            if key not in known and datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+                os.remove(path)
+                stray += 1
+    print(f"Deleted {stray} stray blob files.")
+
+    # Thumbnail derivatives whose source image is gone
+    live = set()
+    for model, column in REFERENCES:
+        live.update(source_digest(value) for value, in db.session.query(column).filter(column.isnot(None)))
+    root = os.path.join(app.config['UPLOAD_FOLDER'], 'derivatives')
+    derivatives = 0
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if name.split('_')[0] not in live:
+                os.remove(os.path.join(folder, name))
+                derivatives += 1
+    print(f"Deleted {derivatives} orphaned thumbnail derivatives.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Garbage-collect unreferenced upload blobs')
+    parser.add_argument('--adopt-legacy', action='store_true',
+                        help='move pre-blob-store uploads into the store first')
+    parser.add_argument('--grace-hours', type=float, default=None,
+                        help='keep unreferenced blobs younger than this (default: BLOB_GC_GRACE_HOURS)')
+    args = parser.parse_args()
+
+    grace_hours = app.config['BLOB_GC_GRACE_HOURS'] if args.grace_hours is None else args.grace_hours
+    with app.app_context():
+        if args.adopt_legacy:
+            adopt_legacy_files()
+        recount_references()
+        collect_garbage(timedelta(hours=grace_hours))
+
+
+if __name__ == '__main__':
+    main()
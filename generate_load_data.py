@@ -0,0 +1,206 @@
+# generate_load_data.py
+# Fills the configured database (DATABASE_URL) with a large synthetic LMS for load
+# testing: users, courses with modules/contents/quizzes/assignments, enrollments,
+# content completions, quiz attempts and forum traffic. Rows are written with bulk
+# executemany inserts in large batches; ids are assigned up front so no row is ever
+# read back. Every generated user's password is "password123".
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from app import app, db
+from models import User, Course, Module, Content, Quiz, Question, Assignment, Enrollment
+from models import ContentCompletion, QuizAttempt, ForumThread, ForumPost
+from rebuild_counters import rebuild_counters
+from completion import rebuild_completion
+from search import rebuild_index
+
+MODULES_PER_COURSE = 4
+CONTENTS_PER_MODULE = 5
+QUESTIONS_PER_QUIZ = 5
+THREADS_PER_COURSE = 2
+POSTS_PER_THREAD = 10
+INSTRUCTOR_RATIO = 100  # one instructor per this many users
+CATEGORIES = ['Programming', 'Data Science', 'Design', 'Business', 'Marketing', 'Languages', 'Music']
+WORDS = ('python data design web machine learning marketing finance music history art science '
+         'statistics cloud security mobile writing photography leadership databases networks').split()
+
+
+class BulkWriter:
+    # Buffers rows per model. When any buffer fills, every buffer is written in the
+    # order the models were first seen, so parents always land before children.
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.pending = {}
+        self.written = {}
+
+    def add(self, model, row):
+        rows = self.pending.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for model, rows in self.pending.items():
+            if rows:
+                db.session.execute(db.insert(model), rows)
+                self.written[model.__tablename__] = self.written.get(model.__tablename__, 0) + len(rows)
+                self.pending[model] = []
+        db.session.commit()
+
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def generate(users, courses, completions, attempts, batch_size, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    password = generate_password_hash('password123')
+    writer = BulkWriter(batch_size)
+
+    def moment(days):
+        return now - timedelta(seconds=rng.randint(0, days * 86400))
+
+    base = {model: next_id(model) for model in (
+        User, Course, Module, Content, Quiz, Question, Assignment, ForumThread
+    )}
+    contents_per_course = MODULES_PER_COURSE * CONTENTS_PER_MODULE
+    instructors = max(1, users // INSTRUCTOR_RATIO)
+
+    for number in range(users):
+        user_id = base[User] + number
+        writer.add(User, {
+            'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+            'password': password, 'is_instructor': number < instructors, 'created_at': moment(730)
+        })
+    writer.flush()
+
+    for number in range(courses):
+        course_id = base[Course] + number
+        title = words(rng, 3).title()
+        writer.add(Course, {
+            'id': course_id, 'title': f'{title} {number}', 'description': words(rng, 30),
+            'category': rng.choice(CATEGORIES), 'instructor_id': base[User] + number % instructors,
+            'created_at': moment(365)
+        })
+        for module_number in range(MODULES_PER_COURSE):
+            module_id = base[Module] + number * MODULES_PER_COURSE + module_number
+            writer.add(Module, {
+                'id': module_id, 'title': f'Module {module_number + 1}', 'description': words(rng, 10),
+                'order': module_number + 1, 'course_id': course_id
+            })
+            for content_number in range(CONTENTS_PER_MODULE):
+                writer.add(Content, {
+                    'id': base[Content] + (number * MODULES_PER_COURSE + module_number) * CONTENTS_PER_MODULE
+                    + content_number,
+                    'title': f'Lesson {content_number + 1}', 'content_type': 'text',
+                    'content_text': words(rng, 60), 'order': content_number + 1, 'module_id': module_id
+                })
+        first_module = base[Module] + number * MODULES_PER_COURSE
+        quiz_id = base[Quiz] + number
+        writer.add(Quiz, {'id': quiz_id, 'title': 'Final quiz', 'time_limit': 20, 'passing_score': 70,
+                          'module_id': first_module + MODULES_PER_COURSE - 1})
+        for question_number in range(QUESTIONS_PER_QUIZ):
+            writer.add(Question, {
+                'id': base[Question] + number * QUESTIONS_PER_QUIZ + question_number,
+                'text': f'{words(rng, 8)}?', 'question_type': 'true_false', 'options': None,
+                'correct_answer': rng.choice(['True', 'False']), 'points': 1, 'quiz_id': quiz_id
+            })
+        writer.add(Assignment, {'id': base[Assignment] + number, 'title': 'Project', 'description': words(rng, 20),
+                                'max_score': 100, 'module_id': first_module + MODULES_PER_COURSE - 1})
+    writer.flush()
+
+    # Enrollments follow a skewed popularity curve. Each enrollment completes a
+    # uniformly random prefix of its course, sized so the total lands on the target.
+    enrollments_per_user = max(1, min(courses, -(-2 * completions // (contents_per_course * users))))
+    average_completed = completions / (users * enrollments_per_user)
+    attempt_rate = attempts / (users * enrollments_per_user)
+    cumulative_weights = []
+    total_weight = 0.0
+    for rank in range(courses):
+        total_weight += 1 / (rank + 1) ** 0.8
+        cumulative_weights.append(total_weight)
+    course_order = list(range(courses))
+    rng.shuffle(course_order)
+
+    for number in range(instructors, users):
+        student_id = base[User] + number
+        chosen = set()
+        while len(chosen) < enrollments_per_user:
+            chosen.update(rng.choices(course_order, cum_weights=cumulative_weights,
+                                      k=enrollments_per_user - len(chosen)))
+        for course_number in chosen:
+            course_id = base[Course] + course_number
+            enrolled_at = moment(365)
+            writer.add(Enrollment, {'student_id': student_id, 'course_id': course_id, 'enrolled_at': enrolled_at})
+
+            done = min(contents_per_course, int(rng.uniform(0, 2 * average_completed + 1)))
+            first_content = base[Content] + course_number * contents_per_course
+            for offset in range(done):
+                writer.add(ContentCompletion, {'user_id': student_id, 'content_id': first_content + offset,
+                                               'completed_at': enrolled_at + timedelta(hours=offset)})
+
+            for _ in range(int(attempt_rate) + (rng.random() < attempt_rate % 1)):
+                writer.add(QuizAttempt, {
+                    'user_id': student_id, 'quiz_id': base[Quiz] + course_number,
+                    'score': float(rng.randint(0, QUESTIONS_PER_QUIZ) * 100 // QUESTIONS_PER_QUIZ),
+                    'answers': '{}', 'started_at': enrolled_at, 'completed_at': enrolled_at + timedelta(minutes=15)
+                })
+    writer.flush()
+
+    for number in range(courses):
+        for thread_number in range(THREADS_PER_COURSE):
+            thread_id = base[ForumThread] + number * THREADS_PER_COURSE + thread_number
+            created_at = moment(180)
+            writer.add(ForumThread, {
+                'id': thread_id, 'title': f'{words(rng, 5)}?', 'content': words(rng, 40),
+                'user_id': base[User] + rng.randrange(users), 'course_id': base[Course] + number,
+                'created_at': created_at
+            })
+            for post_number in range(POSTS_PER_THREAD):
+                writer.add(ForumPost, {
+                    'content': words(rng, 25), 'user_id': base[User] + rng.randrange(users),
+                    'thread_id': thread_id, 'created_at': created_at + timedelta(minutes=post_number * 7)
+                })
+    writer.flush()
+    return writer.written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a large synthetic dataset for load testing')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--courses', type=int, default=5_000)
+    parser.add_argument('--completions', type=int, default=10_000_000)
+    parser.add_argument('--attempts', type=int, default=1_000_000, help='quiz attempts')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every count, e.g. 0.01 for a quick run')
+    parser.add_argument('--batch-size', type=int, default=10_000, help='rows per INSERT batch')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    counts = [max(1, int(value * args.scale)) for value in (args.users, args.courses, args.completions, args.attempts)]
+    with app.app_context():
+        print(f"Generating into {db.engine.url.render_as_string(hide_password=True)}")
+        db.create_all()
+        started = time.perf_counter()
+        written = generate(*counts, batch_size=args.batch_size, seed=args.seed)
+        for table, count in written.items():
+            print(f"  {table}: {count} rows")
+        print(f"Inserted in {time.perf_counter() - started:.1f}s; rebuilding derived data...")
+
+    rebuild_counters()
+    with app.app_context():
+        rebuild_completion()
+        rebuild_index()
+    print("Done.")
+
+
+if __name__ == '__main__':
+    main()
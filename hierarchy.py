@@ -0,0 +1,135 @@
+import threading
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Course, Module, Content, Quiz, Assignment
+
+Owner = namedtuple('Owner', ['course_id', 'instructor_id'])
+
+# Parent links between course items, kept in memory so finding the course (and
+# its instructor) behind a content, quiz, assignment or module id is a few dict
+# lookups instead of a chain of lazy loads. Each row only records its direct
+# parent, which is a column of the row itself, so ORM inserts and deletes can
+# be applied incrementally: they are collected per session and applied when it
+# commits (dropped on rollback). Anything not yet known -- rows written by
+# another process or by bulk inserts -- is loaded with one query on first use.
+# Items never move between modules or courses, so entries do not go stale.
+
+# kind -> (model, parent column, parent kind)
+KINDS = {
+    'module': (Module, Module.course_id, 'course'),
+    'content': (Content, Content.module_id, 'module'),
+    'quiz': (Quiz, Quiz.module_id, 'module'),
+    'assignment': (Assignment, Assignment.module_id, 'module'),
+}
+MODEL_KINDS = {Course: 'course', **{model: kind for kind, (model, _, _) in KINDS.items()}}
+
+
+class CourseHierarchy:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._parents = {kind: {} for kind in ('course', *KINDS)}  # course: id -> instructor_id
+        self._lock = threading.Lock()
+
+    def _cached(self, kind, item_id):
+        # Walk up to the course; None if any link is unknown
+        while kind != 'course':
+            item_id = self._parents[kind].get(item_id)
+            if item_id is None:
+                return None
+            kind = KINDS[kind][2]
+        instructor_id = self._parents['course'].get(item_id)
+        return None if instructor_id is None else Owner(item_id, instructor_id)
+
+    def _load(self, kind, item_ids):
+        # One query joining from the items up to their course, recording every level
+        query = db.session.query(KINDS[kind][0].id)
+        if kind != 'module':
+            query = query.add_columns(KINDS[kind][1]).join(Module, KINDS[kind][1] == Module.id)
+        query = query.add_columns(Module.course_id, Course.instructor_id).join(Course, Module.course_id == Course.id)
+        rows = query.filter(KINDS[kind][0].id.in_(item_ids)).all()
+        with self._lock:
+            for row in rows:
+                if kind != 'module':
+                    self._parents[kind][row[0]] = row[1]
+                module_id = row[0] if kind == 'module' else row[1]
+                self._parents['module'][module_id] = row[-2]
+                self._parents['course'][row[-2]] = row[-1]
+
+    def owner(self, kind, item_id):
+        # Owner(course_id, instructor_id) of a module/content/quiz/assignment, or None
+        owner = self._cached(kind, item_id)
+        if owner is not None:
+            self.hits += 1
+            return owner
+        self.misses += 1
+        self._load(kind, [item_id])
+        return self._cached(kind, item_id)
+
+    def course_of(self, kind, item_id):
+        owner = self.owner(kind, item_id)
+        return None if owner is None else owner.course_id
+
+    def courses_of(self, kind, item_ids):
+        # {item_id: course_id} for the ids that exist, with one query for the misses
+        found, missing = {}, []
+        for item_id in item_ids:
+            owner = self._cached(kind, item_id)
+            if owner is None:
+                missing.append(item_id)
+            else:
+                found[item_id] = owner.course_id
+        self.hits += len(found)
+        if missing:
+            self.misses += len(missing)
+            self._load(kind, missing)
+            for item_id in missing:
+                owner = self._cached(kind, item_id)
+                if owner is not None:
+                    found[item_id] = owner.course_id
+        return found
+
+    def apply(self, changes):
+        with self._lock:
+            for kind, item_id, parent_id in changes:
+                if parent_id is None:
+                    self._parents[kind].pop(item_id, None)
+                else:
+                    self._parents[kind][item_id] = parent_id
+
+    def clear(self):
+        with self._lock:
+            for parents in self._parents.values():
+                parents.clear()
+
+    def track(self):
+        # Follow ORM inserts and deletes of courses, modules and course items
+        for model, kind in MODEL_KINDS.items():
+            event.listen(model, 'after_insert', _recorder(kind, deleted=False))
+            event.listen(model, 'after_delete', _recorder(kind, deleted=True))
+
+        @event.listens_for(Session, 'after_commit')
+        def apply_changes(session):
+            changes = session.info.pop('hierarchy_changes', None)
+            if changes:
+                self.apply(changes)
+
+        @event.listens_for(Session, 'after_rollback')
+        def discard_changes(session):
+            session.info.pop('hierarchy_changes', None)
+
+
+def _recorder(kind, deleted):
+    # (kind, id, parent id) for the session to apply on commit; None removes the entry
+    def record(mapper, connection, target):
+        if deleted:
+            parent_id = None
+        elif kind == 'course':
+            parent_id = target.instructor_id
+        else:
+            parent_id = getattr(target, KINDS[kind][1].key)
+        Session.object_session(target).info.setdefault('hierarchy_changes', []).append((kind, target.id, parent_id))
+    return record
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask_login import UserMixin
+
+from models import db, User, Course, Enrollment
+
+PrincipalFields = namedtuple('PrincipalFields', ['id', 'username', 'email', 'is_instructor'])
+# Course ids a user is enrolled in and teaches
+CourseAccess = namedtuple('CourseAccess', ['enrolled', 'teaching'])
+
+
+class Principal(PrincipalFields, UserMixin):
+    # What current_user is on requests after login: the fields the views and
+    # templates read, without the password hash or relationships. Routes that
+    # need the full row (profile) load the User themselves.
+    pass
+
+
+def load_principal(user_id):
+    row = db.session.query(User.id, User.username, User.email, User.is_instructor).filter(
+        User.id == user_id
+    ).first()
+    if row is None:
+        return None
+    return Principal(row.id, row.username, row.email, bool(row.is_instructor))
+
+
+def load_course_access(user_id):
+    rows = db.session.execute(
+        db.select(Enrollment.course_id, db.literal(False)).where(Enrollment.student_id == user_id).union_all(
+            db.select(Course.id, db.literal(True)).where(Course.instructor_id == user_id)
+        )
+    )
+    enrolled, teaching = set(), set()
+    for course_id, owned in rows:
+        (teaching if owned else enrolled).add(course_id)
+    return CourseAccess(frozenset(enrolled), frozenset(teaching))
+
+
+class UserCache:
+    # Per-process TTL + LRU of one value per user id, produced by load(user_id)
+    def __init__(self, load, ttl=60, max_entries=10000):
+        self.load = load
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (expires, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        return self.refresh(user_id)
+
+    def refresh(self, user_id):
+        value = self.load(user_id)
+        if value is not None:
+            with self._lock:
+                self._entries[user_id] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class IdentityCache(UserCache):
+    # Profile changes invalidate the entry in the process that made them; the
+    # TTL bounds how long other worker processes may keep the old name or role.
+    def __init__(self, ttl=60, max_entries=10000):
+        super().__init__(load_principal, ttl, max_entries)
+
+
+class AccessCache(UserCache):
+    # Answers "may this user see this course?" from the sets of course ids the
+    # user is enrolled in and teaches. Access is only ever granted (nobody is
+    # unenrolled and courses keep their instructor), so a cached yes is final;
+    # a no is re-checked against the database once, which covers enrollments
+    # and courses created in other worker processes since the set was loaded.
+    def __init__(self, ttl=60, max_entries=10000):
+        super().__init__(load_course_access, ttl, max_entries)
+
+    def _check(self, user_id, course_id, field):
+        if course_id in getattr(self.get(user_id), field):
+            return True
+        return course_id in getattr(self.refresh(user_id), field)
+
+    def is_enrolled(self, user_id, course_id):
+        return self._check(user_id, course_id, 'enrolled')
+
+    def is_instructor_of(self, user_id, course_id):
+        return self._check(user_id, course_id, 'teaching')
+
+    def can_view(self, user_id, course_id):
+        # Students enrolled in the course and its instructor
+        access = self.get(user_id)
+        if course_id in access.enrolled or course_id in access.teaching:
+            return True
+        access = self.refresh(user_id)
+        return course_id in access.enrolled or course_id in access.teaching
+
+    def enrolled_in(self, user_id, course_ids):
+        # The subset of course_ids the user is enrolled in, reloading at most once
+        course_ids = set(course_ids)
+        enrolled = self.get(user_id).enrolled
+        if not course_ids <= enrolled:
+            enrolled = self.refresh(user_id).enrolled
+        return course_ids & enrolled
@@ -0,0 +1,41 @@
+# import_courses.py
+import argparse
+import sys
+import time
+
+from app import app, db
+from models import User
+from course_packages import import_package, PackageError
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a course package (zip) written by export_courses.py')
+    parser.add_argument('package', help='package file to read')
+    parser.add_argument('--instructor', help='email of the instructor for courses whose own instructor '
+                                             'does not exist here')
+    parser.add_argument('--preserve-ids', action='store_true',
+                        help='keep the ids from the package instead of assigning new ones')
+    args = parser.parse_args()
+
+    with app.app_context():
+        instructor_id = None
+        if args.instructor:
+            instructor_id = db.session.query(User.id).filter_by(email=args.instructor).scalar()
+            if instructor_id is None:
+                sys.exit(f'No user with email {args.instructor}')
+
+        started = time.perf_counter()
+        try:
+            imported, failed = import_package(args.package, instructor_id, args.preserve_ids)
+        except PackageError as e:
+            sys.exit(str(e))
+        for name, error in failed:
+            print(f"  {name}: {error}")
+        print(f"Imported {len(imported)} courses in {time.perf_counter() - started:.1f}s; {len(failed)} failed.")
+        db.session.remove()
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
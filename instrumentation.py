@@ -0,0 +1,137 @@
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from markupsafe import escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOWEST_KEPT = 5
+
+# Collapse literals and expanded IN lists so queries that differ only in their
+# parameters share one shape
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def statement_shape(statement):
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _STRING.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    return _PLACEHOLDER_LIST.sub('(?...)', shape)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.slowest = []  # [(seconds, statement)], longest first
+        self.shapes = Counter()
+        self._render_started = []
+
+    def record_query(self, statement, seconds):
+        self.query_count += 1
+        self.db_time += seconds
+        self.shapes[statement_shape(statement)] += 1
+        if len(self.slowest) < SLOWEST_KEPT or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, statement))
+            self.slowest.sort(key=lambda entry: entry[0], reverse=True)
+            del self.slowest[SLOWEST_KEPT:]
+
+    def repeated_shapes(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.query_count} queries", '
+            f'render;dur={self.render_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+def request_stats():
+    # Stats for the current request, or None outside one (or when disabled)
+    if not has_request_context():
+        return None
+    return g.get('_request_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats()
+    if stats is not None:
+        stats.record_query(statement, time.perf_counter() - context._query_started)
+
+
+def _before_render(sender, template, context, **extra):
+    stats = request_stats()
+    if stats is not None:
+        stats._render_started.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stats = request_stats()
+    if stats is not None and stats._render_started:
+        stats.render_time += time.perf_counter() - stats._render_started.pop()
+
+
+def _debug_panel(stats):
+    rows = ''.join(
+        f'<tr><td>{seconds * 1000:.1f}&nbsp;ms</td><td><code>{escape(statement)}</code></td></tr>'
+        for seconds, statement in stats.slowest
+    )
+    return (
+        '<div id="sql-debug-panel" style="position:fixed;bottom:0;right:0;max-width:60%;max-height:40%;'
+        'overflow:auto;z-index:9999;background:#fff;border:1px solid #adb5bd;font-size:12px;padding:6px">'
+        f'<strong>{stats.query_count} queries, {stats.db_time * 1000:.1f} ms in the database, '
+        f'{stats.render_time * 1000:.1f} ms rendering</strong>'
+        f'<table class="table table-sm mb-0">{rows}</table></div>'
+    )
+
+
+def init_instrumentation(app):
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+
+    # Listening on the Engine class covers every engine the app creates
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    slow_query = app.config['SLOW_QUERY_MS'] / 1000
+    repeat_threshold = app.config['N_PLUS_ONE_THRESHOLD']
+
+    @app.before_request
+    def start_request_stats():
+        g._request_stats = RequestStats()
+
+    @app.after_request
+    def report_request_stats(response):
+        stats = request_stats()
+        if stats is None:
+            return response
+
+        endpoint = request.endpoint or request.path
+        for seconds, statement in stats.slowest:
+            if seconds >= slow_query:
+                app.logger.warning('Slow query in %s (%.1f ms): %s', endpoint, seconds * 1000, statement)
+        for shape, count in stats.repeated_shapes(repeat_threshold):
+            app.logger.warning('Possible N+1 in %s: %d x %s', endpoint, count, shape)
+
+        response.headers['Server-Timing'] = stats.server_timing()
+        if app.config['DEBUG_PANEL_ENABLED'] and response.mimetype == 'text/html' \
+                and not response.direct_passthrough:
+            body = response.get_data(as_text=True)
+            if '</body>' in body:
+                response.set_data(body.replace('</body>', _debug_panel(stats) + '</body>', 1))
+        return response
@@ -0,0 +1,31 @@
+# issue_certificates.py
+import argparse
+import time
+
+from app import app, db
+from models import Course
+from certificates import issue_certificates, completed_student_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Issue certificates to every student who completed a course')
+    parser.add_argument('course_ids', type=int, nargs='*', help='courses to process (default: all)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='render processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        courses = Course.query.filter(Course.id.in_(args.course_ids)) if args.course_ids else Course.query
+        for course in courses.order_by(Course.id).all():
+            student_ids = completed_student_ids(course.id)
+            if not student_ids:
+                continue
+            started = time.perf_counter()
+            certificates = issue_certificates(course, student_ids, workers=args.workers)
+            elapsed = time.perf_counter() - started
+            print(f"{course.title}: {len(certificates)} certificates in {elapsed:.2f}s")
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
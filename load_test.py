@@ -0,0 +1,313 @@
+# load_test.py
+# Replays a weighted mix of learner traffic against the app and reports latency
+# percentiles and throughput per route. Runs in-process through Flask's test client
+# by default, or over HTTP with --url against a running server that uses the same
+# database (ids and logins are looked up locally). Seed the database first with
+# generate_load_data.py.
+import argparse
+import http.cookiejar
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from app import app, db
+from engine_profiles import profile_name
+from models import User, Module, Content, Quiz, Question, Enrollment, ForumThread
+
+PASSWORD = 'password123'
+CSRF_FIELD = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+# (name, weight): the share of requests each action gets
+WORKLOAD = [
+    ('catalog', 15),
+    ('search', 5),
+    ('dashboard', 15),
+    ('view_content', 25),
+    ('mark_complete', 20),
+    ('take_quiz', 5),
+    ('forum_read', 10),
+    ('forum_post', 5),
+]
+
+
+class InProcessClient:
+    def __init__(self):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.close()
+        return response.status_code
+
+    def post(self, path, data=None, json_body=None):
+        response = self.client.post(path, data=data, json=json_body)
+        response.close()
+        return response.status_code
+
+    def login(self, email):
+        # CSRF is switched off for the in-process app
+        return self.post('/login', data={'email': email, 'password': PASSWORD})
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect
+        )
+
+    def _send(self, request):
+        # (status, body)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path))[0]
+
+    def post(self, path, data=None, json_body=None):
+        if json_body is not None:
+            body, content_type = json.dumps(json_body).encode(), 'application/json'
+        else:
+            body, content_type = urllib.parse.urlencode(data or {}).encode(), 'application/x-www-form-urlencoded'
+        return self._send(urllib.request.Request(self.base_url + path, data=body, method='POST',
+                                                 headers={'Content-Type': content_type}))[0]
+
+    def login(self, email):
+        # The login form is CSRF-protected, so read the token from the page first
+        status, body = self._send(urllib.request.Request(self.base_url + '/login'))
+        token = CSRF_FIELD.search(body.decode('utf-8', 'replace'))
+        data = {'email': email, 'password': PASSWORD, 'csrf_token': token.group(1) if token else ''}
+        return self.post('/login', data=data)
+
+
+def load_learners(count, seed):
+    # Pick learners with enrollments and everything their requests will need
+    rng = random.Random(seed)
+    student_ids = [user_id for user_id, in db.session.query(Enrollment.student_id).distinct().limit(count * 20)]
+    if not student_ids:
+        sys.exit('No enrollments found; run generate_load_data.py first.')
+    student_ids = rng.sample(student_ids, min(count, len(student_ids)))
+
+    emails = dict(db.session.query(User.id, User.email).filter(User.id.in_(student_ids)))
+    enrolled = defaultdict(list)
+    for student_id, course_id in db.session.query(Enrollment.student_id, Enrollment.course_id).filter(
+        Enrollment.student_id.in_(student_ids)
+    ):
+        enrolled[student_id].append(course_id)
+    course_ids = {course_id for courses in enrolled.values() for course_id in courses}
+
+    contents = defaultdict(list)
+    for course_id, module_id, content_id in db.session.query(Module.course_id, Module.id, Content.id).join(
+        Content, Content.module_id == Module.id
+    ).filter(Module.course_id.in_(course_ids)):
+        contents[course_id].append((module_id, content_id))
+    quizzes = defaultdict(list)
+    for course_id, quiz_id in db.session.query(Module.course_id, Quiz.id).join(
+        Quiz, Quiz.module_id == Module.id
+    ).filter(Module.course_id.in_(course_ids)):
+        quizzes[course_id].append(quiz_id)
+    questions = defaultdict(list)
+    for quiz_id, question_id in db.session.query(Question.quiz_id, Question.id).filter(
+        Question.quiz_id.in_([quiz_id for ids in quizzes.values() for quiz_id in ids])
+    ):
+        questions[quiz_id].append(question_id)
+    threads = defaultdict(list)
+    for course_id, thread_id in db.session.query(ForumThread.course_id, ForumThread.id).filter(
+        ForumThread.course_id.in_(course_ids)
+    ):
+        threads[course_id].append(thread_id)
+
+    return [{
+        'email': emails[student_id],
+        'courses': enrolled[student_id],
+        'contents': contents,
+        'quizzes': quizzes,
+        'questions': questions,
+        'threads': threads,
+    } for student_id in student_ids]
+
+
+def run_action(action, client, learner, rng):
+    # Returns the status code, or None when the learner has nothing to do for it
+    course_id = rng.choice(learner['courses'])
+    if action == 'catalog':
+        return client.get('/')
+    if action == 'search':
+        return client.get('/search?q=' + rng.choice(['python', 'data', 'design', 'music', 'security']))
+    if action == 'dashboard':
+        return client.get('/dashboard')
+    if action in ('view_content', 'mark_complete'):
+        if not learner['contents'][course_id]:
+            return None
+        module_id, content_id = rng.choice(learner['contents'][course_id])
+        if action == 'view_content':
+            return client.get(f'/learn/{course_id}/module/{module_id}/content/{content_id}')
+        return client.post(f'/api/progress/{content_id}')
+    if action == 'take_quiz':
+        if not learner['quizzes'][course_id]:
+            return None
+        quiz_id = rng.choice(learner['quizzes'][course_id])
+        answers = {f'question_{question_id}': rng.choice(['True', 'False'])
+                   for question_id in learner['questions'][quiz_id]}
+        return client.post(f'/quiz/{quiz_id}/take', data=answers)
+    if action == 'forum_read':
+        if learner['threads'][course_id] and rng.random() < 0.5:
+            return client.get(f'/thread/{rng.choice(learner["threads"][course_id])}')
+        return client.get(f'/course/{course_id}/forum')
+    if action == 'forum_post':
+        if not learner['threads'][course_id]:
+            return None
+        return client.post(f'/thread/{rng.choice(learner["threads"][course_id])}/post',
+                           data={'content': 'Load test reply'})
+    raise ValueError(action)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(learners, make_client, duration, requests_per_learner, seed):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    names, weights = zip(*WORKLOAD)
+    deadline = time.perf_counter() + duration if duration else None
+    lock = threading.Lock()
+
+    def learner_loop(number, learner):
+        rng = random.Random(seed + number)
+        client = make_client()
+        if client.login(learner['email']) != 302:
+            with lock:
+                errors['login'] += 1
+            return
+        sent = 0
+        while (deadline is None and sent < requests_per_learner) or (deadline and time.perf_counter() < deadline):
+            action = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            status = run_action(action, client, learner, rng)
+            elapsed = time.perf_counter() - started
+            if status is None:
+                continue
+            sent += 1
+            with lock:
+                latencies[action].append(elapsed)
+                if status >= 400:
+                    errors[action] += 1
+
+    threads = [threading.Thread(target=learner_loop, args=(number, learner))
+               for number, learner in enumerate(learners)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies, errors, elapsed):
+    results = {}
+    for action, _ in WORKLOAD:
+        ordered = sorted(latencies.get(action, []))
+        results[action] = {
+            'requests': len(ordered),
+            'errors': errors.get(action, 0),
+            'p50_ms': percentile(ordered, 0.50) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000,
+            'rps': len(ordered) / elapsed if elapsed else 0.0,
+        }
+    everything = sorted(latency for values in latencies.values() for latency in values)
+    results['total'] = {
+        'requests': len(everything),
+        'errors': sum(count for action, count in errors.items() if action != 'login'),
+        'p50_ms': percentile(everything, 0.50) * 1000,
+        'p95_ms': percentile(everything, 0.95) * 1000,
+        'p99_ms': percentile(everything, 0.99) * 1000,
+        'rps': len(everything) / elapsed if elapsed else 0.0,
+    }
+    return results
+
+
+def print_report(results):
+    print(f"{'route':<15}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for action, result in results.items():
+        print(f"{action:<15}{result['requests']:>10}{result['errors']:>8}{result['p50_ms']:>10.1f}"
+              f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['rps']:>10.1f}")
+
+
+def compare(results, baseline, tolerance):
+    # Routes whose p95 got worse than the baseline by more than the tolerance
+    regressions = []
+    for action, result in results.items():
+        before = baseline.get(action)
+        if before and before['p95_ms'] and result['requests']:
+            if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append((action, before['p95_ms'], result['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the app with a mix of learner traffic')
+    parser.add_argument('--url', help='base URL of a running server (default: test the app in-process)')
+    parser.add_argument('--learners', type=int, default=20, help='concurrent simulated learners')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run (0: use --requests)')
+    parser.add_argument('--requests', type=int, default=100, help='requests per learner when --duration is 0')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare p95 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown vs the baseline')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        learners = load_learners(args.learners, args.seed)
+        db.session.remove()
+
+    if args.url:
+        def make_client():
+            return HttpClient(args.url)
+    else:
+        make_client = InProcessClient
+
+    # Over HTTP the server's own DB_PROFILE applies; keep it the same as here
+    target = args.url or 'in-process app'
+    print(f"{len(learners)} learners against {target} for "
+          f"{f'{args.duration:.0f}s' if args.duration else f'{args.requests} requests each'}"
+          f" (engine profile: {profile_name(app.config)})")
+    latencies, errors, elapsed = run(learners, make_client, args.duration, args.requests, args.seed)
+    if errors.get('login'):
+        print(f"{errors['login']} learners could not log in")
+    results = summarize(latencies, errors, elapsed)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for action, before, after in regressions:
+            print(f"REGRESSION {action}: p95 {before:.1f} ms -> {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
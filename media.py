@@ -0,0 +1,70 @@
+import mimetypes
+import os
+
+from flask import current_app, abort, send_file
+from werkzeug.security import safe_join
+
+# Types a browser can display without running anything in the app's origin. SVG
+# is an image but may carry script, so it is downloaded like everything else.
+INLINE_TYPE_PREFIXES = ('image/', 'video/')
+INLINE_TYPES = {'application/pdf'}
+SCRIPTABLE_TYPES = {'image/svg+xml'}
+
+
+def upload_path(filename):
+    # Absolute path of a stored upload, or None if it is not a file under UPLOAD_FOLDER
+    if not filename:
+        return None
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+
+def inline_type(filename):
+    # MIME type to serve a file inline with, or None if it must be a download
+    mimetype = mimetypes.guess_type(filename)[0]
+    if mimetype is None or mimetype in SCRIPTABLE_TYPES:
+        return None
+    if mimetype in INLINE_TYPES or mimetype.startswith(INLINE_TYPE_PREFIXES):
+        return mimetype
+    return None
+
+
+def send_upload(filename, download_name=None, max_age=None, private=False):
+    path = upload_path(filename)
+    if path is None:
+        abort(404)
+    mimetype = inline_type(filename)
+
+    # Let nginx stream the bytes from an internal location when configured
+    accel_prefix = current_app.config.get('MEDIA_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        response = current_app.response_class()
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+        response.headers['Content-Type'] = mimetype or 'application/octet-stream'
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        if mimetype is None:
+            response.headers['Content-Disposition'] = \
+                f'attachment; filename="{download_name or os.path.basename(filename)}"'
+        elif download_name:
+            response.headers['Content-Disposition'] = f'inline; filename="{download_name}"'
+        return response
+
+    # send_file streams in chunks (or emits X-Sendfile when USE_X_SENDFILE is on),
+    # answers Range requests and sets ETag/Last-Modified for conditional 304s.
+    response = send_file(
+        path,
+        mimetype=mimetype or 'application/octet-stream',
+        as_attachment=mimetype is None,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+        max_age=current_app.config['MEDIA_MAX_AGE'] if max_age is None else max_age
+    )
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if private:
+        # Access-controlled files must not be stored by shared caches
+        response.cache_control.public = False
+        response.cache_control.private = True
+    return response
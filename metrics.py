@@ -0,0 +1,405 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, g, request
+
+# Prometheus text-format metrics without a client library. Every thread writes to
+# its own shard of plain dicts, so recording a value never takes a lock; a scrape
+# sums the shards. Shards of threads that have exited (servers may start one per
+# request) are folded into a retired total when the next thread starts or at the
+# next scrape, so their number stays bounded by the live threads. Under a multi-process server (gunicorn) set METRICS_MULTIPROC_DIR:
+# each worker then dumps its totals to <dir>/<pid>-<start>.json every few seconds and a
+# scrape, whichever worker serves it, adds up all the files. A worker holds a flock
+# on <dir>/<pid>-<start>.lock while it runs; once that lock is free its last dump is
+# folded into <dir>/archive.json and removed, so the directory stays bounded and a
+# reused pid starts a new file instead of overwriting a dead worker's totals.
+
+ARCHIVE = 'archive'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metadata = {}  # name -> (type, help, buckets)
+        self._shards = []  # (thread, shard) for every thread that has recorded a value
+        self._retired = ({}, {})  # totals from the shards of threads that have exited
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        # Called with the lock held; a thread that has exited no longer writes to its shard
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = live
+
+    def counter(self, name, help_text):
+        self._metadata[name] = ('counter', help_text, None)
+        return Counter(self, name)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._metadata[name] = ('histogram', help_text, tuple(buckets))
+        return Histogram(self, name)
+
+    def gauge(self, name, help_text):
+        # Gauges are only set by collectors at scrape time
+        self._metadata[name] = ('gauge', help_text, None)
+
+    def register_collector(self, collector):
+        # collector() yields (name, labels, value) for counters or gauges read at scrape time
+        self._collectors.append(collector)
+
+    def _inc(self, name, value, labels):
+        counters = self._shard()[0]
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def _observe(self, name, value, labels):
+        histograms = self._shard()[1]
+        key = _key(name, labels)
+        buckets = self._metadata[name][2]
+        entry = histograms.get(key)
+        if entry is None:
+            # One slot per bucket plus +Inf, then sum and count
+            entry = histograms[key] = [0] * (len(buckets) + 3)
+        entry[bisect_left(buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def snapshot(self):
+        values, histograms = {}, {}
+        with self._lock:
+            self._retire_dead_shards()
+            _merge((values, histograms), self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _merge((values, histograms), shard)
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                key = _key(name, labels)
+                values[key] = values.get(key, 0) + value
+        return values, histograms
+
+    def render(self, values, histograms):
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._metadata.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type != 'histogram':
+                for (series, labels), value in sorted(values.items()):
+                    if series == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            for (series, labels), entry in sorted(histograms.items()):
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), entry):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(entry[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {entry[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, value=1, **labels):
+        self.registry._inc(self.name, value, labels)
+
+
+class Histogram:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def observe(self, value, **labels):
+        self.registry._observe(self.name, value, labels)
+
+
+def _merge(totals, shard):
+    # Add a shard's counters and histogram entries into totals; copies guard
+    # against the owning thread adding keys meanwhile
+    values, histograms = totals
+    counters, shard_histograms = shard
+    for key, value in dict(counters).items():
+        values[key] = values.get(key, 0) + value
+    for key, entry in dict(shard_histograms).items():
+        total = histograms.setdefault(key, [0] * len(entry))
+        for index, value in enumerate(list(entry)):
+            total[index] += value
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape_label(value)}"' for label, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram('eduflow_http_request_duration_seconds', 'Request latency by endpoint')
+REQUESTS = registry.counter('eduflow_http_requests_total', 'Requests by endpoint, method and status')
+REQUEST_ERRORS = registry.counter('eduflow_http_request_errors_total', 'Responses with a 5xx status by endpoint')
+POOL_CHECKOUT = registry.histogram('eduflow_db_pool_checkout_seconds',
+                                   'Time spent waiting for a database connection', CHECKOUT_BUCKETS)
+UPLOAD_BYTES = registry.counter('eduflow_upload_bytes_total', 'Bytes received in uploads')
+registry.counter('eduflow_cache_hits_total', 'Cache hits by cache')
+registry.counter('eduflow_cache_misses_total', 'Cache misses by cache')
+registry.gauge('eduflow_db_pool_checked_out', 'Connections currently checked out of the pool')
+registry.gauge('eduflow_db_pool_overflow', 'Connections open beyond the pool size')
+registry.gauge('eduflow_db_pool_size', 'Configured pool size')
+
+GAUGES = {name for name, metadata in registry._metadata.items() if metadata[0] == 'gauge'}
+
+
+def track_cache(name, cache):
+    # Export a cache's hits/misses attributes; the hit ratio is
+    # rate(hits) / (rate(hits) + rate(misses))
+    def collect():
+        yield 'eduflow_cache_hits_total', {'cache': name}, cache.hits
+        yield 'eduflow_cache_misses_total', {'cache': name}, cache.misses
+    registry.register_collector(collect)
+
+
+def track_pool(engine):
+    pool = engine.pool
+    connect = pool.connect
+
+    # Pool events fire after a connection has been handed out, so time the
+    # checkout call itself
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_CHECKOUT.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+    def collect():
+        if hasattr(pool, 'overflow'):
+            yield 'eduflow_db_pool_checked_out', {}, pool.checkedout()
+            yield 'eduflow_db_pool_overflow', {}, max(pool.overflow(), 0)
+            yield 'eduflow_db_pool_size', {}, pool.size()
+    registry.register_collector(collect)
+
+
+_process_lock = threading.Lock()
+_process = None  # (pid, file name, lock file) of the process running the dumper
+
+
+def _dump(directory):
+    # A forked child that never started the dumper inherits the parent's _process
+    if _process is None or _process[0] != os.getpid():
+        return
+    values, histograms = registry.snapshot()
+    payload = {
+        'values': [[name, labels, value] for (name, labels), value in values.items()],
+        'histograms': [[name, labels, entry] for (name, labels), entry in histograms.items()],
+    }
+    _write_json(os.path.join(directory, f'{_process[1]}.json'), payload)
+
+
+def _write_json(path, payload):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as dump:
+        json.dump(payload, dump)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as dump:
+            return json.load(dump)
+    except (OSError, ValueError):
+        return None
+
+
+def _add_payload(totals, payload, skip_gauges):
+    values, histograms = totals
+    for name, labels, value in payload['values']:
+        if name in GAUGES and skip_gauges:
+            continue
+        key = (name, tuple(tuple(pair) for pair in labels))
+        values[key] = values.get(key, 0) + value
+    for name, labels, entry in payload['histograms']:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        total = histograms.setdefault(key, [0] * len(entry))
+        for index, value in enumerate(entry):
+            total[index] += value
+
+
+def _archive_dead_processes(directory):
+    # Called with archive.lock held. The archive records the names it folded last
+    # time, so a crash before their files were removed does not count them twice.
+    archive_path = os.path.join(directory, f'{ARCHIVE}.json')
+    archive = _read_json(archive_path) or {'values': [], 'histograms': [], 'folded': []}
+    already_folded = set(archive['folded'])
+    names = {
+        filename.rsplit('.', 1)[0] for filename in os.listdir(directory)
+        if filename.endswith(('.json', '.lock'))
+    } - {ARCHIVE}
+
+    totals = ({}, {})
+    _add_payload(totals, archive, skip_gauges=True)
+    folded = []
+    for name in sorted(names):
+        try:
+            lock_file = open(os.path.join(directory, f'{name}.lock'), 'a+')
+        except OSError:
+            continue
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # still running
+            payload = _read_json(os.path.join(directory, f'{name}.json'))
+            if payload is not None and name not in already_folded:
+                _add_payload(totals, payload, skip_gauges=True)
+            folded.append(name)
+    if not folded:
+        return
+
+    values, histograms = totals
+    _write_json(archive_path, {
+        'values': [[name, labels, value] for (name, labels), value in values.items()],
+        'histograms': [[name, labels, entry] for (name, labels), entry in histograms.items()],
+        'folded': folded,
+    })
+    for name in folded:
+        for suffix in ('.json', '.lock'):
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def _aggregate(directory, gauge_max_age):
+    # Counters and histograms from every process, including ones that have exited;
+    # gauges only from processes that dumped recently
+    totals = ({}, {})
+    now = time.time()
+    with open(os.path.join(directory, f'{ARCHIVE}.lock'), 'a') as archive_lock:
+        fcntl.flock(archive_lock, fcntl.LOCK_EX)
+        _archive_dead_processes(directory)
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(directory, filename)
+            payload = _read_json(path)
+            try:
+                fresh = now - os.path.getmtime(path) <= gauge_max_age
+            except OSError:
+                continue
+            if payload is not None:
+                _add_payload(totals, payload, skip_gauges=not fresh)
+    return totals
+
+
+def _start_dumper(directory, interval):
+    # Once per process, from its first request: threads started in a preloading
+    # master do not survive the fork into workers
+    global _process
+    if _process is not None and _process[0] == os.getpid():
+        return
+    with _process_lock:
+        if _process is not None and _process[0] == os.getpid():
+            return
+        name = f'{os.getpid()}-{int(time.time() * 1000)}'
+        # Locked before it is renamed into place, so a scrape never sees it unlocked
+        lock_path = os.path.join(directory, f'{name}.lock')
+        lock_file = open(f'{lock_path}.tmp', 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        os.replace(f'{lock_path}.tmp', lock_path)
+        _process = (os.getpid(), name, lock_file)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                _dump(directory)
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name='metrics-dump', daemon=True).start()
+    atexit.register(_dump, directory)
+
+
+def init_metrics(app, db):
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    with app.app_context():
+        track_pool(db.engine)
+
+    directory = app.config['METRICS_MULTIPROC_DIR']
+    interval = app.config['METRICS_DUMP_INTERVAL']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def start_request_timer():
+        if directory:
+            _start_dumper(directory, interval)
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            REQUEST_ERRORS.inc(endpoint=endpoint)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+
+        if directory:
+            _dump(directory)
+            values, histograms = _aggregate(directory, gauge_max_age=3 * interval)
+        else:
+            values, histograms = registry.snapshot()
+        return Response(registry.render(values, histograms), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,97 @@
+# migrate_db.py
+from sqlalchemy import inspect, text
+from app import app, db
+from rebuild_counters import rebuild_counters
+from search import rebuild_index
+from backfill_completion import backfill_completion
+
+# Columns added after the initial schema, as (name, DDL type) per table.
+NEW_COLUMNS = {
+    'course': [
+        ('enrollment_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('module_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('required_item_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('cache_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+    'enrollment': [
+        ('completed_item_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+    'forum_thread': [
+        ('post_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+}
+
+# Progress rows duplicated content_completion; fold any that are missing from it
+# into content_completion, then drop the table.
+MERGE_PROGRESS_STATEMENTS = [
+    """
+    INSERT INTO content_completion (user_id, content_id, completed_at)
+    SELECT e.student_id, p.content_id, MIN(COALESCE(p.completed_at, e.enrolled_at))
+    FROM progress p JOIN enrollment e ON e.id = p.enrollment_id
+    WHERE p.completed AND NOT EXISTS (
+        SELECT 1 FROM content_completion c WHERE c.user_id = e.student_id AND c.content_id = p.content_id
+    )
+    GROUP BY e.student_id, p.content_id
+    """,
+    "DROP TABLE progress",
+]
+
+# Duplicate rows have to be merged before the unique indexes can be built.
+DEDUPLICATE_STATEMENTS = [
+    """
+    DELETE FROM enrollment WHERE id NOT IN (
+        SELECT MIN(id) FROM enrollment GROUP BY student_id, course_id
+    )
+    """,
+    """
+    DELETE FROM content_completion WHERE id NOT IN (
+        SELECT MIN(id) FROM content_completion GROUP BY user_id, content_id
+    )
+    """,
+    """
+    DELETE FROM certificate WHERE id NOT IN (
+        SELECT MIN(id) FROM certificate GROUP BY user_id, course_id
+    )
+    """,
+]
+
+
+def migrate_database():
+    with app.app_context():
+        # Create any tables that do not exist yet
+        db.create_all()
+
+        inspector = inspect(db.engine)
+        with db.engine.begin() as connection:
+            for table, columns in NEW_COLUMNS.items():
+                existing = {column['name'] for column in inspector.get_columns(table)}
+                for name, ddl in columns:
+                    if name not in existing:
+                        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+                        print(f"Added column {table}.{name}")
+
+            if inspector.has_table('progress'):
+                for statement in MERGE_PROGRESS_STATEMENTS:
+                    connection.execute(text(statement))
+                print("Merged progress into content_completion")
+
+            for statement in DEDUPLICATE_STATEMENTS:
+                connection.execute(text(statement))
+
+            for table in db.metadata.sorted_tables:
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(bind=connection)
+                        print(f"Created index {index.name}")
+
+    rebuild_counters()
+    backfill_completion()
+    with app.app_context():
+        rebuild_index()
+    print("Rebuilt the course search index.")
+    print("Database schema is up to date.")
+
+
+if __name__ == '__main__':
+    migrate_database()
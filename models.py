@@ -1,11 +1,37 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import json
 
 db = SQLAlchemy()
 
 
+def insert_ignoring_conflicts(model):
+    # INSERT ... ON CONFLICT DO NOTHING for the dialects that support it, otherwise None
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return None
+
+
+def insert_or_ignore(model, **values):
+    # Single-statement insert that silently skips rows violating a unique constraint.
+    # Returns True when a row was inserted.
+    statement = insert_ignoring_conflicts(model)
+    if statement is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(model(**values))
+            return True
+        except IntegrityError:
+            return False
+    return db.session.execute(statement.values(**values)).rowcount > 0
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -16,6 +42,8 @@ class User(UserMixin, db.Model):
 
     courses_teaching = db.relationship('Course', backref='instructor', lazy=True)
     enrollments = db.relationship('Enrollment', backref='student', lazy=True)
+    certificates = db.relationship('Certificate', backref='user', lazy=True,
+                                   order_by='Certificate.issued_at.desc()')
 
 
 class Course(db.Model):
@@ -25,9 +53,14 @@ class Course(db.Model):
     category = db.Column(db.String(100))
     thumbnail = db.Column(db.String(200))
     instructor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    modules = db.relationship('Module', backref='course', lazy=True, cascade='all, delete-orphan')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    enrollment_count = db.Column(db.Integer, nullable=False, default=0)
+    module_count = db.Column(db.Integer, nullable=False, default=0)
+    required_item_count = db.Column(db.Integer, nullable=False, default=0)  # contents + quizzes + assignments
+    cache_version = db.Column(db.Integer, nullable=False, default=0)  # bumped when its cached fragments change
+
+    modules = db.relationship('Module', backref='course', lazy=True, cascade='all, delete-orphan',
+                              order_by='Module.order')
     enrollments = db.relationship('Enrollment', backref='course', lazy=True)
 
 
@@ -36,9 +69,10 @@ class Module(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     order = db.Column(db.Integer, nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False, index=True)
 
-    contents = db.relationship('Content', backref='module', lazy=True, cascade='all, delete-orphan')
+    contents = db.relationship('Content', backref='module', lazy=True, cascade='all, delete-orphan',
+                               order_by='Content.order')
     quizzes = db.relationship('Quiz', backref='module', lazy=True, cascade='all, delete-orphan')
     assignments = db.relationship('Assignment', backref='module', lazy=True, cascade='all, delete-orphan')
 
@@ -50,7 +84,7 @@ class Content(db.Model):
     content_url = db.Column(db.String(500))  # For video embeds/file paths
     content_text = db.Column(db.Text)  # For text content
     order = db.Column(db.Integer, nullable=False)
-    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False)
+    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False, index=True)
 
     completions = db.relationship('ContentCompletion', backref='content', lazy=True)
 
@@ -61,7 +95,7 @@ class Quiz(db.Model):
     description = db.Column(db.Text)
     time_limit = db.Column(db.Integer)  # in minutes
     passing_score = db.Column(db.Integer, default=70)  # percentage
-    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False)
+    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False, index=True)
 
     questions = db.relationship('Question', backref='quiz', lazy=True, cascade='all, delete-orphan')
     attempts = db.relationship('QuizAttempt', backref='quiz', lazy=True)
@@ -83,34 +117,57 @@ class Assignment(db.Model):
     description = db.Column(db.Text)
     due_date = db.Column(db.DateTime)
     max_score = db.Column(db.Integer, default=100)
-    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False)
+    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False, index=True)
 
     submissions = db.relationship('Submission', backref='assignment', lazy=True)
 
 
 class Enrollment(db.Model):
+    __table_args__ = (
+        db.Index('uq_enrollment_student_course', 'student_id', 'course_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False, index=True)
     enrolled_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed = db.Column(db.Boolean, default=False)
     completed_at = db.Column(db.DateTime)
+    completed_item_count = db.Column(db.Integer, nullable=False, default=0)
 
-    progress = db.relationship('Progress', backref='enrollment', lazy=True)
 
+class ContentCompletion(db.Model):
+    __table_args__ = (
+        db.Index('uq_content_completion_user_content', 'user_id', 'content_id', unique=True),
+    )
 
-class Progress(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content_id = db.Column(db.Integer, db.ForeignKey('content.id'), nullable=False)
-    completed = db.Column(db.Boolean, default=False)
-    completed_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
-class ContentCompletion(db.Model):
+class QuizCompletion(db.Model):
+    # First passing attempt per user and quiz
+    __table_args__ = (
+        db.Index('uq_quiz_completion_user_quiz', 'user_id', 'quiz_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    content_id = db.Column(db.Integer, db.ForeignKey('content.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class AssignmentCompletion(db.Model):
+    # First graded submission per user and assignment
+    __table_args__ = (
+        db.Index('uq_assignment_completion_user_assignment', 'user_id', 'assignment_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
     completed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
@@ -135,8 +192,34 @@ class Submission(db.Model):
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     graded_at = db.Column(db.DateTime)
 
+    user = db.relationship('User')
+
+
+class Blob(db.Model):
+    key = db.Column(db.String(120), primary_key=True)  # blobs/ab/cd/<sha256><ext>, relative to UPLOAD_FOLDER
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Upload(db.Model):
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, handed to the client
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    stored_name = db.Column(db.String(300), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
 
 class Certificate(db.Model):
+    __table_args__ = (
+        db.Index('uq_certificate_user_course', 'user_id', 'course_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
@@ -144,21 +227,36 @@ class Certificate(db.Model):
     issued_at = db.Column(db.DateTime, default=datetime.utcnow)
     certificate_number = db.Column(db.String(100), unique=True)
 
+    course = db.relationship('Course')
+
 
 class ForumThread(db.Model):
+    __table_args__ = (
+        db.Index('ix_forum_thread_course_created', 'course_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
 
+    user = db.relationship('User')
+    course = db.relationship('Course')
     posts = db.relationship('ForumPost', backref='thread', lazy=True)
 
 
 class ForumPost(db.Model):
+    __table_args__ = (
+        db.Index('ix_forum_post_thread_created', 'thread_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     thread_id = db.Column(db.Integer, db.ForeignKey('forum_thread.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User')
@@ -0,0 +1,63 @@
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor'])
+
+
+def _encode(key, row_id):
+    raw = f'{key}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode(cursor, parse_key):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        key, row_id = raw.split('|')
+        return parse_key(key), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def encode_cursor(created_at, row_id):
+    return _encode(created_at.isoformat(), row_id)
+
+
+def decode_cursor(cursor):
+    # Returns (created_at, id), or None for a missing or malformed cursor
+    return _decode(cursor, datetime.fromisoformat)
+
+
+def encode_rank_cursor(rank, row_id):
+    # repr() round-trips the float exactly, so the seek lands on the same row
+    return _encode(repr(float(rank)), row_id)
+
+
+def decode_rank_cursor(cursor):
+    # Returns (rank, id), or None for a missing or malformed cursor
+    return _decode(cursor, float)
+
+
+def keyset_paginate(query, model, cursor=None, per_page=20, descending=True):
+    # Seek past the cursor on (created_at, id) instead of using OFFSET, so every page
+    # costs one index range scan no matter how deep it is.
+    key = tuple_(model.created_at, model.id)
+    position = decode_cursor(cursor)
+    if position is not None:
+        query = query.filter(key < tuple_(*position) if descending else key > tuple_(*position))
+
+    if descending:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at.asc(), model.id.asc())
+
+    items = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return KeysetPage(items, next_cursor)
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from collections import namedtuple
+
+from models import db, Quiz, Question, Module
+
+CompiledQuestion = namedtuple('CompiledQuestion', [
+    'id', 'text', 'question_type', 'options', 'correct_answer', 'points'
+])
+AnswerKey = namedtuple('AnswerKey', [
+    'id', 'course_id', 'title', 'description', 'time_limit', 'passing_score', 'questions', 'total_points'
+])
+
+
+def parse_options(value):
+    try:
+        return json.loads(value) if value else []
+    except ValueError:
+        return []
+
+
+def compile_answer_key(quiz_id):
+    row = db.session.query(Quiz, Module.course_id).join(
+        Module, Quiz.module_id == Module.id
+    ).filter(Quiz.id == quiz_id).first()
+    if row is None:
+        return None
+
+    quiz, course_id = row
+    questions = tuple(
+        CompiledQuestion(
+            id=question.id,
+            text=question.text,
+            question_type=question.question_type,
+            options=tuple(parse_options(question.options)),
+            correct_answer=question.correct_answer,
+            points=question.points or 0
+        )
+        for question in Question.query.filter_by(quiz_id=quiz_id).order_by(Question.id)
+    )
+    return AnswerKey(
+        id=quiz.id,
+        course_id=course_id,
+        title=quiz.title,
+        description=quiz.description,
+        time_limit=quiz.time_limit,
+        passing_score=quiz.passing_score,
+        questions=questions,
+        total_points=sum(question.points for question in questions)
+    )
+
+
+def grade_submission(answer_key, form):
+    score = 0
+    answers = {}
+    for question in answer_key.questions:
+        answer = form.get(f'question_{question.id}')
+        answers[str(question.id)] = answer
+        if answer == question.correct_answer:
+            score += question.points
+
+    total_points = answer_key.total_points
+    final_score = (score / total_points * 100) if total_points > 0 else 0
+    return final_score, answers
+
+
+# Per-process cache of compiled quiz answer keys. Entries are dropped explicitly when
+# a quiz's questions change and expire after `ttl` seconds so other worker processes
+# pick up edits as well. A key compiled while an invalidation ran is returned but not
+# stored, since it may have been read before the edit.
+class AnswerKeyCache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, quiz_id):
+        entry = self._entries.get(quiz_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._generation
+        answer_key = compile_answer_key(quiz_id)
+        if answer_key is not None:
+            with self._lock:
+                if self._generation == generation:
+                    self._entries[quiz_id] = (time.monotonic() + self.ttl, answer_key)
+        return answer_key
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(quiz_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
@@ -0,0 +1,28 @@
+# rebuild_counters.py
+from app import app, db
+from models import Course, Module, Enrollment, ForumThread, ForumPost
+
+
+def rebuild_counters():
+    with app.app_context():
+        enrollment_counts = db.select(db.func.count(Enrollment.id)).where(
+            Enrollment.course_id == Course.id
+        ).scalar_subquery()
+        module_counts = db.select(db.func.count(Module.id)).where(
+            Module.course_id == Course.id
+        ).scalar_subquery()
+        post_counts = db.select(db.func.count(ForumPost.id)).where(
+            ForumPost.thread_id == ForumThread.id
+        ).scalar_subquery()
+
+        db.session.execute(db.update(Course).values(
+            enrollment_count=enrollment_counts,
+            module_count=module_counts
+        ))
+        db.session.execute(db.update(ForumThread).values(post_count=post_counts))
+        db.session.commit()
+        print("Rebuilt enrollment, module and forum reply counters.")
+
+
+if __name__ == '__main__':
+    rebuild_counters()
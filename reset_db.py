@@ -1,5 +1,6 @@
 # reset_db.py
 import os
+import shutil
 from app import app, db
 from add_sample_data import add_sample_data
 
@@ -10,6 +11,10 @@ def reset_database():
         db.drop_all()
         print("Dropped all existing tables.")
 
+        # Cached fragments are keyed by course id, which new courses will reuse
+        if app.config['FRAGMENT_CACHE_DIR']:
+            shutil.rmtree(app.config['FRAGMENT_CACHE_DIR'], ignore_errors=True)
+
         # Create all tables
         db.create_all()
         print("Created all tables.")
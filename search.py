@@ -0,0 +1,218 @@
+import re
+import threading
+
+from sqlalchemy import event, text
+
+from models import db, Course, Module, Content
+from pagination import encode_rank_cursor, decode_rank_cursor
+
+SEARCH_TABLE = 'course_search'
+
+# Column weights for ranking: title, description, module titles, content text
+WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+
+SQLITE_DDL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    category UNINDEXED, title, description, modules, contents,
+    tokenize = 'porter unicode61'
+)
+"""
+
+POSTGRES_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+        course_id INTEGER PRIMARY KEY REFERENCES course (id) ON DELETE CASCADE,
+        category VARCHAR(100),
+        document TSVECTOR NOT NULL
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_category ON {SEARCH_TABLE} (category)",
+]
+
+
+def _dialect(bind):
+    return bind.dialect.name
+
+
+def create_search_table(target, connection, **kw):
+    dialect = _dialect(connection)
+    if dialect == 'sqlite':
+        connection.execute(text(SQLITE_DDL))
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_DDL:
+            connection.execute(text(statement))
+
+
+def drop_search_table(target, connection, **kw):
+    if _dialect(connection) in ('sqlite', 'postgresql'):
+        connection.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+
+# Keep the search table in step with db.create_all() / db.drop_all()
+event.listen(db.metadata, 'after_create', create_search_table)
+event.listen(db.metadata, 'before_drop', drop_search_table)
+
+
+def _fts5_query(query):
+    # Turn free text into an FTS5 expression: every word must match, as a prefix
+    terms = re.findall(r'\w+', query, re.UNICODE)
+    return ' '.join('"{}"*'.format(term) for term in terms)
+
+
+def _document(course_id):
+    course = db.session.get(Course, course_id)
+    if course is None:
+        return None
+
+    module_titles = db.session.query(Module.title).filter(Module.course_id == course_id).all()
+    content_rows = db.session.query(Content.title, Content.content_text).join(
+        Module, Content.module_id == Module.id
+    ).filter(Module.course_id == course_id).all()
+
+    return {
+        'course_id': course.id,
+        'category': course.category,
+        'title': course.title or '',
+        'description': course.description or '',
+        'modules': ' '.join(title for title, in module_titles),
+        'contents': ' '.join(' '.join(filter(None, row)) for row in content_rows),
+    }
+
+
+def index_course(course_id):
+    # Runs inside the caller's transaction so the index commits with the change
+    dialect = _dialect(db.session.get_bind())
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+
+    remove_course(course_id)
+    document = _document(course_id)
+    if document is None:
+        return
+
+    if dialect == 'sqlite':
+        db.session.execute(text(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, category, title, description, modules, contents) '
+            'VALUES (:course_id, :category, :title, :description, :modules, :contents)'
+        ), document)
+    else:
+        db.session.execute(text(
+            f'INSERT INTO {SEARCH_TABLE} (course_id, category, document) VALUES (:course_id, :category, '
+            "setweight(to_tsvector('english', :title), 'A') || "
+            "setweight(to_tsvector('english', :description), 'B') || "
+            "setweight(to_tsvector('english', :modules), 'C') || "
+            "setweight(to_tsvector('english', :contents), 'D'))"
+        ), document)
+
+
+def remove_course(course_id):
+    # The FTS5 table uses the course id as its rowid
+    dialect = _dialect(db.session.get_bind())
+    key = 'rowid' if dialect == 'sqlite' else 'course_id'
+    if dialect in ('sqlite', 'postgresql'):
+        db.session.execute(text(f'DELETE FROM {SEARCH_TABLE} WHERE {key} = :course_id'),
+                           {'course_id': course_id})
+
+
+def rebuild_index():
+    if _dialect(db.session.get_bind()) in ('sqlite', 'postgresql'):
+        db.session.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    for course_id, in db.session.query(Course.id).all():
+        index_course(course_id)
+    db.session.commit()
+
+
+class CategoryCache:
+    # Distinct course categories for the search filter. Courses are only ever
+    # added, never edited or deleted, so the highest course id changes exactly
+    # when a new category may have appeared; reading it is one primary-key
+    # lookup instead of a DISTINCT over every course, and it also picks up
+    # courses created by other worker processes.
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._names = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = db.session.query(db.func.max(Course.id)).scalar()
+        with self._lock:
+            if version == self._version:
+                self.hits += 1
+                return self._names
+        self.misses += 1
+        names = [
+            name for name, in db.session.query(Course.category).filter(
+                Course.category.isnot(None)
+            ).distinct().order_by(Course.category)
+        ]
+        with self._lock:
+            self._version, self._names = version, names
+        return names
+
+    def clear(self):
+        with self._lock:
+            self._version, self._names = None, []
+
+
+def search_courses(query, category=None, cursor=None, per_page=12):
+    # Returns (courses, total, next_cursor) with courses in relevance order. Pages
+    # seek past the cursor's (rank, id) instead of using OFFSET, so results stay
+    # stable while courses are added; every match is still ranked, as any
+    # relevance ordering requires.
+    dialect = _dialect(db.session.get_bind())
+    params = {'category': category, 'limit': per_page + 1}
+    category_filter = ' AND category = :category' if category else ''
+    position = decode_rank_cursor(cursor)
+    if position is not None:
+        params['rank'], params['after_id'] = position
+
+    if dialect == 'sqlite':
+        params['query'] = _fts5_query(query)
+        if not params['query']:
+            return [], 0, None
+        where = f'{SEARCH_TABLE} MATCH :query{category_filter}'
+        # bm25() is lower for better matches
+        seek = 'WHERE score > :rank OR (score = :rank AND course_id > :after_id) ' if position else ''
+        total = db.session.execute(text(f'SELECT count(*) FROM {SEARCH_TABLE} WHERE {where}'), params).scalar()
+        rows = db.session.execute(text(
+            f'SELECT course_id, score FROM (SELECT rowid AS course_id, '
+            f'bm25({SEARCH_TABLE}, 0, {", ".join(map(str, WEIGHTS))}) AS score '
+            f'FROM {SEARCH_TABLE} WHERE {where}) {seek}'
+            'ORDER BY score, course_id LIMIT :limit'
+        ), params).all()
+    elif dialect == 'postgresql':
+        params['query'] = query
+        where = f"document @@ websearch_to_tsquery('english', :query){category_filter}"
+        # float8 so the rank compares exactly against the one in the cursor
+        seek = 'WHERE score < :rank OR (score = :rank AND course_id > :after_id) ' if position else ''
+        total = db.session.execute(text(f'SELECT count(*) FROM {SEARCH_TABLE} WHERE {where}'), params).scalar()
+        rows = db.session.execute(text(
+            'SELECT course_id, score FROM (SELECT course_id, '
+            "ts_rank_cd(document, websearch_to_tsquery('english', :query))::float8 AS score "
+            f'FROM {SEARCH_TABLE} WHERE {where}) ranked {seek}'
+            'ORDER BY score DESC, course_id LIMIT :limit'
+        ), params).all()
+    else:
+        courses = Course.query.filter(
+            (Course.title.contains(query)) | (Course.description.contains(query))
+        )
+        if category:
+            courses = courses.filter(Course.category == category)
+        total = courses.count()
+        if position is not None:
+            courses = courses.filter(Course.id > position[1])
+        courses = courses.order_by(Course.id).limit(per_page + 1).all()
+        next_cursor = encode_rank_cursor(0, courses[per_page - 1].id) if len(courses) > per_page else None
+        return courses[:per_page], total, next_cursor
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_rank_cursor(rows[-1].score, rows[-1].course_id)
+    course_ids = [row.course_id for row in rows]
+    courses = Course.query.options(db.joinedload(Course.instructor)).filter(Course.id.in_(course_ids)).all()
+    by_id = {course.id: course for course in courses}
+    return [by_id[course_id] for course_id in course_ids if course_id in by_id], total, next_cursor
@@ -27,24 +27,96 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
-// Progress tracking for video content
-function trackVideoProgress(videoId, contentId) {
-    const video = document.getElementById(videoId);
+// Completion events are queued in localStorage, so they survive going offline or
+// leaving the page, and sent together to /api/progress/batch
+class ProgressQueue {
+    constructor(storageKey = 'eduflow.pendingProgress', delay = 2000, maxBatch = 500) {
+        this.storageKey = storageKey;
+        this.delay = delay;
+        this.maxBatch = maxBatch;
+        this.timer = null;
+        this.sending = false;
 
-    video.addEventListener('ended', function() {
-        fetch(`/api/progress/${contentId}`, {
+        window.addEventListener('online', () => this.flush());
+        window.addEventListener('pagehide', () => this.flush());
+    }
+
+    load() {
+        try {
+            return JSON.parse(localStorage.getItem(this.storageKey)) || [];
+        } catch (error) {
+            return [];
+        }
+    }
+
+    save(events) {
+        localStorage.setItem(this.storageKey, JSON.stringify(events));
+    }
+
+    add(contentId) {
+        const events = this.load();
+        if (!events.some(event => event.content_id === contentId)) {
+            events.push({content_id: contentId, completed_at: new Date().toISOString()});
+            this.save(events);
+        }
+        this.schedule();
+    }
+
+    schedule() {
+        if (!this.timer) {
+            this.timer = setTimeout(() => this.flush(), this.delay);
+        }
+    }
+
+    flush() {
+        clearTimeout(this.timer);
+        this.timer = null;
+        const batch = this.load().slice(0, this.maxBatch);
+        if (!batch.length || this.sending || !navigator.onLine) {
+            return;
+        }
+
+        this.sending = true;
+        fetch('/api/progress/batch', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({events: batch}),
+            keepalive: true
+        })
+        .then(response => {
+            // Server errors are retried later; a rejected batch would only fail again
+            if (response.status >= 500) {
+                throw new Error(`Server responded ${response.status}`);
             }
+            // Events added while the request was in flight sit after this batch
+            this.save(this.load().slice(batch.length));
+            return response.json();
         })
-        .then(response => response.json())
         .then(data => {
             console.log('Progress saved:', data);
+            this.sending = false;
+            if (this.load().length) {
+                this.schedule();
+            }
         })
         .catch(error => {
             console.error('Error saving progress:', error);
+            this.sending = false;
         });
+    }
+}
+
+const progressQueue = new ProgressQueue();
+document.addEventListener('DOMContentLoaded', () => progressQueue.flush());
+
+// Progress tracking for video content
+function trackVideoProgress(videoId, contentId) {
+    const video = document.getElementById(videoId);
+
+    video.addEventListener('ended', function() {
+        progressQueue.add(contentId);
     });
 }
 
@@ -77,4 +149,102 @@ class QuizTimer {
             clearInterval(this.interval);
         }
     }
-}
\ No newline at end of file
+}
+// Resumable chunked uploads: the file goes up in pieces through /api/uploads and the
+// form is then submitted with just the upload id.
+class ChunkedUploader {
+    constructor(file, chunkSize = 8 * 1024 * 1024) {
+        this.file = file;
+        this.chunkSize = chunkSize;
+        this.uploadId = null;
+        this.maxRetries = 5;
+        this.onProgress = null;
+    }
+
+    async start() {
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({filename: this.file.name, size: this.file.size})
+        });
+        const status = await response.json();
+        if (!response.ok) {
+            throw new Error(status.message);
+        }
+        this.uploadId = status.upload_id;
+        return this.resume();
+    }
+
+    async currentOffset() {
+        const response = await fetch(`/api/uploads/${this.uploadId}`);
+        return (await response.json()).offset;
+    }
+
+    async resume() {
+        let offset = await this.currentOffset();
+        let failures = 0;
+
+        while (offset < this.file.size) {
+            try {
+                const response = await fetch(`/api/uploads/${this.uploadId}`, {
+                    method: 'PATCH',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'Upload-Offset': offset
+                    },
+                    body: this.file.slice(offset, offset + this.chunkSize)
+                });
+                const status = await response.json();
+                // A 409 means the server has a different offset; carry on from there
+                if (!response.ok && response.status !== 409) {
+                    throw new Error(status.message);
+                }
+                offset = status.offset;
+                failures = 0;
+            } catch (error) {
+                if (++failures > this.maxRetries) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                offset = await this.currentOffset();
+            }
+
+            if (this.onProgress) {
+                this.onProgress(offset / this.file.size);
+            }
+        }
+        return this.uploadId;
+    }
+}
+
+function enableChunkedUpload(formId) {
+    const form = document.getElementById(formId);
+    const input = form.querySelector('input[type="file"][data-chunked-upload]');
+    const uploadIdField = form.querySelector('input[name="upload_id"]');
+
+    form.addEventListener('submit', function(e) {
+        if (!input.files.length || uploadIdField.value) {
+            return;
+        }
+        e.preventDefault();
+
+        const uploader = new ChunkedUploader(input.files[0]);
+        const submitButton = form.querySelector('[type="submit"]');
+        submitButton.disabled = true;
+        uploader.onProgress = function(fraction) {
+            submitButton.value = submitButton.textContent = `Uploading ${Math.round(fraction * 100)}%`;
+        };
+
+        uploader.start().then(function(uploadId) {
+            uploadIdField.value = uploadId;
+            // The bytes are already on the server; don't send them again
+            input.disabled = true;
+            form.submit();
+        }).catch(function(error) {
+            submitButton.disabled = false;
+            alert('Upload failed: ' + error.message);
+        });
+    });
+}
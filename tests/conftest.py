@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Tests import the app from the repository root against a throwaway SQLite
+# database, so they never touch instance/eduflow.db
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+workdir = tempfile.mkdtemp(prefix='eduflow-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'test.db')
+os.environ['WRITE_BEHIND_JOURNAL'] = os.path.join(workdir, 'write_behind.journal')
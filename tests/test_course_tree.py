@@ -0,0 +1,57 @@
+from sqlalchemy import event
+
+from app import app, db, load_course_tree
+from models import User, Course, Module, Content, Quiz, Assignment
+
+
+def create_course(instructor_id, title, modules):
+    course = Course(title=title, description=title, instructor_id=instructor_id)
+    db.session.add(course)
+    db.session.flush()
+    for number in range(modules):
+        module = Module(title=f'Module {number}', order=number + 1, course_id=course.id)
+        db.session.add(module)
+        db.session.flush()
+        db.session.add_all([
+            Content(title=f'Lesson {number}', content_type='text', content_text='text', order=1, module_id=module.id),
+            Content(title=f'Video {number}', content_type='video', order=2, module_id=module.id),
+            Quiz(title=f'Quiz {number}', module_id=module.id),
+            Assignment(title=f'Assignment {number}', module_id=module.id),
+        ])
+    db.session.commit()
+    return course.id
+
+
+def count_tree_queries(course_id):
+    # Statements issued to load the tree and walk everything the outline renders
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            course = load_course_tree(course_id)
+            course.instructor.username
+            for module in course.modules:
+                for item in (*module.contents, *module.quizzes, *module.assignments):
+                    item.title
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return len(statements), len(course.modules)
+
+
+def test_load_course_tree_query_count_does_not_grow_with_modules():
+    with app.app_context():
+        db.create_all()
+        instructor = User(username='tree_instructor', email='tree@example.com', password='x', is_instructor=True)
+        db.session.add(instructor)
+        db.session.commit()
+        small = create_course(instructor.id, 'Small', modules=3)
+        large = create_course(instructor.id, 'Large', modules=13)
+
+    small_queries, small_modules = count_tree_queries(small)
+    large_queries, large_modules = count_tree_queries(large)
+    assert (small_modules, large_modules) == (3, 13)
+    assert small_queries == large_queries
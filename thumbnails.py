@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+from PIL import Image, ImageOps
+
+from blobstore import is_blob_key
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+
+
+class UndecodableImage(Exception):
+    pass
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=current_app.config['THUMBNAIL_WORKERS'],
+                                           thread_name_prefix='thumbnails')
+        return _executor
+
+
+def source_digest(key):
+    # Blob keys already carry the content hash; legacy files are keyed by name
+    if is_blob_key(key):
+        return os.path.basename(key).split('.')[0]
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def derivative_name(key, width, image_format):
+    digest = source_digest(key)
+    return f'derivatives/{digest[:2]}/{digest}_{width}.{image_format}'
+
+
+def failure_marker_name(key):
+    # Left next to the derivatives when the source cannot be decoded, so it is
+    # not queued again; gc_blobs.py removes it with the source like a derivative
+    digest = source_digest(key)
+    return f'derivatives/{digest[:2]}/{digest}_failed'
+
+
+def render_derivatives(source_path, targets):
+    # targets: [(width, image_format, destination_path)]. Runs in the worker pool,
+    # outside any request or app context.
+    try:
+        with Image.open(source_path) as original:
+            image = ImageOps.exif_transpose(original).convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise UndecodableImage(str(e)) from e
+
+    for width, image_format, destination in targets:
+        if os.path.exists(destination):
+            continue
+        resized = image.copy()
+        if resized.width > width:
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        pil_format, options = FORMATS[image_format]
+        temp_path = destination + '.tmp'
+        resized.save(temp_path, pil_format, **options)
+        os.replace(temp_path, destination)
+
+
+def _derivative_path(name):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *name.split('/'))
+
+
+def schedule_derivatives(key):
+    # Queue every configured size/format of an uploaded image; returns immediately
+    if not key:
+        return None
+    source_path = os.path.join(current_app.config['UPLOAD_FOLDER'], *key.split('/'))
+    marker_path = _derivative_path(failure_marker_name(key))
+    if not os.path.isfile(source_path) or os.path.exists(marker_path):
+        return None
+
+    targets = [
+        (width, image_format, _derivative_path(derivative_name(key, width, image_format)))
+        for width in current_app.config['THUMBNAIL_WIDTHS']
+        for image_format in FORMATS
+    ]
+    digest = source_digest(key)
+    with _executor_lock:
+        if digest in _in_flight or all(os.path.exists(target[2]) for target in targets):
+            return None
+        _in_flight.add(digest)
+
+    logger = current_app.logger
+
+    def run():
+        try:
+            render_derivatives(source_path, targets)
+        except UndecodableImage as e:
+            logger.warning('Not rendering thumbnails for %s, which cannot be decoded: %s', key, e)
+            _write_failure_marker(marker_path, str(e))
+        except Exception:
+            logger.exception('Could not render thumbnails for %s', key)
+        finally:
+            with _executor_lock:
+                _in_flight.discard(digest)
+
+    return _pool().submit(run)
+
+
+def _write_failure_marker(path, reason):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as marker:
+            marker.write(reason)
+    except OSError:
+        pass
+
+
+def derivative_for(key, width, image_format):
+    # Stored name of a ready derivative, the source itself if it cannot be
+    # decoded, or None after queueing it for rendering
+    name = derivative_name(key, width, image_format)
+    if os.path.isfile(_derivative_path(name)):
+        return name
+    if os.path.exists(_derivative_path(failure_marker_name(key))):
+        return key
+    schedule_derivatives(key)
+    return None
+
+
+def thumbnail_srcset(course, image_format):
+    return ', '.join(
+        f"{url_for('course_thumbnail_variant', course_id=course.id, width=width, image_format=image_format)} {width}w"
+        for width in current_app.config['THUMBNAIL_WIDTHS']
+    )
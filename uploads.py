@@ -0,0 +1,167 @@
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+from models import db, Upload
+from blobstore import staging_path, blob_path, put_file, add_ref
+from metrics import UPLOAD_BYTES
+
+CHUNK_READ_SIZE = 64 * 1024
+
+# Running SHA-256 state per upload so each chunk is hashed once, as it is written.
+# A worker that did not see the earlier chunks rebuilds the state from disk.
+_hashers = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _upload_lock(upload_id):
+    with _registry_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _stored_path(upload):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], upload.stored_name)
+
+
+def _hasher_for(upload):
+    state = _hashers.get(upload.id)
+    if state is not None and state[0] == upload.received:
+        return state[1]
+
+    hasher = hashlib.sha256()
+    with open(_stored_path(upload), 'rb') as stored:
+        remaining = upload.received
+        while remaining:
+            block = stored.read(min(CHUNK_READ_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def create_upload(user_id, filename, size):
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError('A positive file size is required')
+    if size > current_app.config['MAX_UPLOAD_SIZE']:
+        raise UploadError('File is too large', status=413)
+    filename = secure_filename(filename or '')
+    if not filename:
+        raise UploadError('A file name is required')
+
+    upload_id = uuid.uuid4().hex
+    upload = Upload(
+        id=upload_id,
+        user_id=user_id,
+        filename=filename,
+        stored_name=f'incoming/{upload_id}',
+        size=size
+    )
+    # Chunks are written straight into this file, which is renamed into the blob
+    # store once complete
+    open(staging_path(upload_id), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def write_chunk(upload, offset, stream, length, expected_sha256=None):
+    # Append `length` bytes from `stream` at `offset`, which must equal the bytes
+    # received so far. The final chunk may carry the client's SHA-256 for an
+    # integrity check. Returns the new offset.
+    if upload.completed_at is not None:
+        raise UploadError('Upload is already complete', status=409)
+    if length is None:
+        raise UploadError('Content-Length is required', status=411)
+
+    with _upload_lock(upload.id):
+        db.session.refresh(upload)
+        if offset != upload.received:
+            raise UploadError(f'Expected offset {upload.received}', status=409)
+        if offset + length > upload.size:
+            raise UploadError('Chunk extends past the declared file size', status=413)
+
+        hasher = _hasher_for(upload)
+        written = 0
+        with open(_stored_path(upload), 'r+b') as stored:
+            stored.seek(offset)
+            while written < length:
+                block = stream.read(min(CHUNK_READ_SIZE, length - written))
+                if not block:
+                    break
+                stored.write(block)
+                hasher.update(block)
+                written += len(block)
+            # Drop anything left over from an earlier, interrupted attempt
+            stored.truncate(offset + written)
+
+        UPLOAD_BYTES.inc(written)
+        upload.received = offset + written
+        if upload.received < upload.size:
+            _hashers[upload.id] = (upload.received, hasher)
+            db.session.commit()
+            return upload.received
+
+        _hashers.pop(upload.id, None)
+        sha256 = hasher.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            # Corrupted in transit: start over rather than keep bad bytes
+            upload.received = 0
+            open(_stored_path(upload), 'wb').close()
+            db.session.commit()
+            raise UploadError('Checksum mismatch; upload restarted', status=422)
+
+        upload.sha256 = sha256
+        upload.completed_at = datetime.utcnow()
+        upload.stored_name = put_file(_stored_path(upload), sha256, upload.filename)
+        db.session.commit()
+
+    with _registry_lock:
+        _locks.pop(upload.id, None)
+    return upload.received
+
+
+def check_extension(filename, allowed_extensions):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension not in allowed_extensions:
+        raise UploadError(f'File type not allowed; use one of: {", ".join(allowed_extensions)}', status=415)
+
+
+def check_image(source):
+    # Reject files that only carry an image extension; `source` is a path or file object
+    try:
+        with Image.open(source) as image:
+            image.verify()
+    except Exception:
+        raise UploadError('File is not a valid image', status=415)
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+
+def claim_upload(upload_id, user_id, allowed_extensions, image=False):
+    # Blob key of a finished upload owned by the user, referenced by the record it is attached to
+    upload = db.session.get(Upload, upload_id) if upload_id else None
+    if upload is None or upload.user_id != user_id:
+        raise UploadError('Unknown upload', status=404)
+    if upload.completed_at is None:
+        raise UploadError('Upload is not complete', status=409)
+    check_extension(upload.filename, allowed_extensions)
+    if image:
+        check_image(blob_path(upload.stored_name))
+    add_ref(upload.stored_name)
+    return upload.stored_name
@@ -0,0 +1,336 @@
+import atexit
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from models import db, insert_ignoring_conflicts
+
+
+# Write-behind queue for high-volume inserts. Rows are appended to a local journal
+# file (so they survive a crash) and committed by a background thread in batched
+# transactions of up to `batch_size` rows, at most `max_latency` seconds after they
+# were queued. A checkpoint file next to the journal records the last sequence
+# number that reached the database so replayed rows are not inserted twice.
+#
+# Each process has its own journal, "<journal_path>.<pid>", held under an exclusive
+# flock for as long as the process runs. On start, any journal whose lock can be
+# taken belongs to a process that has exited: its unflushed rows are replayed and
+# the files removed. Locked journals are left to the live process that owns them.
+# Under sustained load the queue never fully drains, so once the journal passes
+# `compact_bytes` it is rewritten with just the rows past the checkpoint.
+class WriteBehindQueue:
+
+    def __init__(self, app=None, journal_path=None, batch_size=200, max_latency=0.25, fsync=False,
+                 compact_bytes=4 * 1024 * 1024):
+        self.app = app
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.enabled = False
+        self._pid = None
+        self._compact_at = compact_bytes
+        self._start_lock = threading.Lock()
+        self._models = {}
+        self._pending = []
+        self._pending_owners = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._journal = None
+        self._journal_file_path = None
+        self._thread = None
+        self._stopping = False
+
+    def register(self, model, ignore_conflicts=False, on_flush=None):
+        # on_flush(rows) runs inside the batch transaction after the rows are inserted
+        self._models[model.__tablename__] = (model, ignore_conflicts, on_flush)
+
+    @property
+    def checkpoint_path(self):
+        return self._journal_file_path + '.checkpoint'
+
+    def start(self):
+        # Safe to call on every request: only the first call in each process does
+        # anything, so it can be started lazily by whichever worker serves requests
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked from a process that had started: its journal, lock and
+                # queued rows stay with that process
+                self.enabled = False
+                self._pending = []
+                self._pending_owners = {}
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+            self._pid = os.getpid()
+            self._start()
+
+    def _start(self):
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        path = f'{self.journal_path}.{os.getpid()}'
+        journal = open(path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Same pid in another container sharing the directory: writes go straight to the database
+            journal.close()
+            self.app.logger.error('Write-behind journal %s is locked by another process; '
+                                  'write-behind stays disabled', path)
+            return
+        self._journal = journal
+        self._journal_file_path = path
+        self._replay_journals()
+        self._stopping = False
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name='write-behind-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if not self.enabled or self._pid != os.getpid():
+            return
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        self._thread.join()
+        self.flush()
+        self.enabled = False
+        # Everything reached the database; remove the files while still holding the lock
+        _remove(self._journal_file_path)
+        _remove(self.checkpoint_path)
+        self._journal.close()
+        self._journal = None
+        self._pid = None
+
+    def enqueue(self, model, owner_id=None, **values):
+        # owner_id is the user who should read this row back (see has_pending)
+        record = {'table': model.__tablename__, 'owner_id': owner_id, 'values': _encode(values)}
+        with self._lock:
+            self._seq += 1
+            record['seq'] = self._seq
+            self._journal.write(json.dumps(record) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._pending.append(record)
+            self._track_owner(record)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def has_pending(self, owner_id):
+        return self._pending_owners.get(owner_id, 0) > 0
+
+    def is_pending(self, model, **match):
+        with self._lock:
+            for record in self._pending:
+                if record['table'] == model.__tablename__ and all(
+                        record['values'].get(key) == value for key, value in match.items()):
+                    return True
+        return False
+
+    def flush(self):
+        # Commit everything queued so far; used by the flusher and for read-your-writes
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+            if not batch:
+                return 0
+
+            committed = 0
+            try:
+                for start in range(0, len(batch), self.batch_size):
+                    chunk = batch[start:start + self.batch_size]
+                    self._write_batch(chunk)
+                    committed += len(chunk)
+            finally:
+                with self._lock:
+                    # Anything not committed goes back to the front of the queue
+                    self._pending[:0] = batch[committed:]
+                    for record in batch[:committed]:
+                        self._untrack_owner(record)
+                    if committed:
+                        _write_checkpoint(self.checkpoint_path, batch[committed - 1]['seq'])
+                    if not self._pending:
+                        # Everything in the journal has reached the database
+                        self._journal.truncate(0)
+                        self._compact_at = self.compact_bytes
+                    elif committed and os.fstat(self._journal.fileno()).st_size > self._compact_at:
+                        self._compact()
+            return committed
+
+    def _compact(self):
+        # Rewrite the journal with only the queued rows; called with _lock held.
+        # The new file is locked before it replaces the old one, so the journal
+        # path is never unlocked while this process is running.
+        temp_path = self._journal_file_path + '.compact'
+        journal = open(temp_path, 'w+', encoding='utf-8')
+        fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for record in self._pending:
+            journal.write(json.dumps(record) + '\n')
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+        os.replace(temp_path, self._journal_file_path)
+        self._journal.close()
+        self._journal = journal
+        # A backlog bigger than compact_bytes (database down) is not rewritten on every flush
+        self._compact_at = max(self.compact_bytes, 2 * os.fstat(journal.fileno()).st_size)
+
+    def _track_owner(self, record):
+        owner_id = record['owner_id']
+        if owner_id is not None:
+            self._pending_owners[owner_id] = self._pending_owners.get(owner_id, 0) + 1
+
+    def _untrack_owner(self, record):
+        owner_id = record['owner_id']
+        if owner_id is not None:
+            self._pending_owners[owner_id] -= 1
+            if not self._pending_owners[owner_id]:
+                del self._pending_owners[owner_id]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.max_latency
+                while not self._stopping and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Write-behind flush failed; retrying')
+                time.sleep(self.max_latency)
+
+    def _write_batch(self, batch):
+        rows_by_table = {}
+        for record in batch:
+            rows_by_table.setdefault(record['table'], []).append(record['values'])
+
+        with self.app.app_context():
+            try:
+                for table, rows in rows_by_table.items():
+                    if table not in self._models:
+                        # Journalled by an older release for a table that is no longer queued
+                        self.app.logger.warning('Dropping %d queued rows for unregistered table %s',
+                                                len(rows), table)
+                        continue
+                    model, ignore_conflicts, on_flush = self._models[table]
+                    rows = [_decode(model, values) for values in rows]
+                    statement = insert_ignoring_conflicts(model) if ignore_conflicts else None
+                    db.session.execute(statement if statement is not None else db.insert(model), rows)
+                    if on_flush is not None:
+                        on_flush(rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def _replay_journals(self):
+        # Our own file first: a process that had the same pid may have left rows in it
+        self._replay(self._journal, self._journal_file_path)
+        self._journal.truncate(0)
+        _remove(self.checkpoint_path)
+        _remove(self._journal_file_path + '.compact')
+        self._seq = 0
+
+        for path in _journal_paths(self.journal_path):
+            if path == self._journal_file_path:
+                continue
+            try:
+                journal = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owned by a running process
+                try:
+                    # Another process may have replayed and removed it before we got the lock
+                    if not os.path.samestat(os.fstat(journal.fileno()), os.stat(path)):
+                        continue
+                except FileNotFoundError:
+                    continue
+                self._replay(journal, path)
+                # The journal goes first: a checkpoint without its journal is harmless
+                _remove(path)
+                _remove(path + '.checkpoint')
+
+    def _replay(self, journal, path):
+        # Commit the rows of a locked journal that are past its checkpoint
+        checkpoint_path = path + '.checkpoint'
+        checkpoint = 0
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+                checkpoint = int(checkpoint_file.read().strip() or 0)
+
+        records = []
+        journal.seek(0)
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn final line from a crash mid-write
+                continue
+            if record['seq'] > checkpoint:
+                records.append(record)
+
+        if records:
+            self.app.logger.info('Replaying %d journaled writes from %s', len(records), path)
+        for start in range(0, len(records), self.batch_size):
+            chunk = records[start:start + self.batch_size]
+            self._write_batch(chunk)
+            _write_checkpoint(checkpoint_path, chunk[-1]['seq'])
+
+
+def _journal_paths(base):
+    # Per-process journals ("<base>.<pid>") and the single journal of older releases
+    directory, name = os.path.split(base)
+    pattern = re.compile(re.escape(name) + r'(\.\d+)?$')
+    return [os.path.join(directory, entry) for entry in sorted(os.listdir(directory)) if pattern.match(entry)]
+
+
+def _write_checkpoint(path, seq):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as checkpoint:
+        checkpoint.write(str(seq))
+    os.replace(temp_path, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _encode(values):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in values.items()}
+
+
+def _decode(model, values):
+    columns = model.__table__.columns
+    decoded = {}
+    for key, value in values.items():
+        if value is not None and isinstance(columns[key].type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        decoded[key] = value
+    return decoded